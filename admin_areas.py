@@ -0,0 +1,337 @@
+import os
+import re
+import json
+import hashlib
+import pandas as pd
+
+# =========================
+# Admin-area (state/locality) IDP aggregates
+# =========================
+# DTM resources list IDPs per location. We collapse them once per refresh into a
+# compact per-admin-area table and join it against a precomputed boundary index,
+# so map renders never touch the raw records.
+STATE_BOUNDARIES_PATH = os.environ.get("SPAFS_STATE_BOUNDARIES", "")        # admin1 GeoJSON
+LOCALITY_BOUNDARIES_PATH = os.environ.get("SPAFS_LOCALITY_BOUNDARIES", "")  # admin2 GeoJSON (optional)
+SIMPLIFY_TOLERANCE = float(os.environ.get("SPAFS_SIMPLIFY_TOLERANCE", "0.01"))  # degrees
+
+# Common spellings that differ between DTM and boundary files
+NAME_ALIASES = {
+    "gezira": "jazirah",
+    "jazeera": "jazirah",
+    "sennar": "sinnar",
+    "gadaref": "gedaref",
+    "algedaref": "gedaref",
+}
+
+# State values DTM uses for a national-total row
+NATIONAL_NAMES = {"sudan", "total", "grandtotal", "national", "country", "all"}
+
+# Label for rows whose locality is blank; they still count towards their state
+UNKNOWN_LOCALITY = "Unknown"
+
+NAME_PROPS = ["ADM2_EN", "admin2Name_en", "ADM1_EN", "admin1Name_en", "NAME_2", "NAME_1", "name", "Name"]
+PCODE_PROPS = ["ADM2_PCODE", "admin2Pcode", "ADM1_PCODE", "admin1Pcode", "pcode"]
+ADM2_PROPS = ["ADM2_EN", "admin2Name_en", "NAME_2", "ADM2_PCODE", "admin2Pcode"]
+ADM1_PROPS = ["ADM1_EN", "admin1Name_en", "NAME_1", "ADM1_PCODE", "admin1Pcode"]   # parent state of a locality
+
+# YlOrRd ramp, light to dark
+COLOR_RAMP = [[255, 255, 178], [254, 204, 92], [253, 141, 60], [240, 59, 32], [189, 0, 38]]
+NO_DATA_COLOR = [80, 80, 80]
+
+
+def normalize_name(name):
+    """
+    Normalize an admin-area name or pcode for matching across sources
+    """
+    if name is None:
+        return ""
+    tokens = re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split()
+    tokens = [t for t in tokens if t not in ("state", "locality", "al", "el", "ad", "an", "as", "ash")]
+    key = "".join(tokens)
+    return NAME_ALIASES.get(key, key)
+
+
+def _find_col(columns, include, exclude=()):
+    for col in columns:
+        c = col.lower()
+        if any(i in c for i in include) and not any(e in c for e in exclude):
+            return col
+    return None
+
+
+def _find_origin_col(columns, locality):
+    for col in columns:
+        c = col.lower()
+        is_locality = "locality" in c or "admin2" in c
+        if "origin" in c and "pcode" not in c and is_locality == locality:
+            return col
+    return None
+
+
+def find_period_col(columns):
+    """
+    Column identifying the DTM round (or reporting date) of each row, if any
+    """
+    return _find_col(columns, ["round"]) or _find_col(columns, ["date", "reporting"], exclude=["update"])
+
+
+def period_values(df, col):
+    """
+    Comparable round numbers / dates for a period column (NaN/NaT where unparseable)
+    """
+    if "date" in col.lower():
+        return pd.to_datetime(df[col], errors="coerce")
+    return pd.to_numeric(df[col], errors="coerce")
+
+
+def _latest_rows(df, counts):
+    """
+    Mask of rows with a count in the latest round (if the resource stacks several)
+    """
+    round_col = find_period_col(df.columns)
+    mask = counts.notna()
+    if round_col:
+        rounds = period_values(df, round_col)
+        if rounds.notna().any():
+            mask &= rounds == rounds.max()
+    return mask
+
+
+def _state_col(columns):
+    return _find_col(columns, ["state", "admin1"], exclude=["origin", "pcode"])
+
+
+def _national_rows(df, state_col):
+    if not state_col:
+        return pd.Series(False, index=df.index)
+    return df[state_col].map(lambda v: pd.notna(v) and normalize_name(v) in NATIONAL_NAMES)
+
+
+def aggregate_admin_areas(df, idp_col):
+    """
+    Collapse DTM location rows into [{"kind", "state", "locality", "idps"}] records.
+    "kind" is "displacement" (where IDPs are now) or "origin" (where they fled from).
+    National-total rows are left out.
+    """
+    cols = list(df.columns)
+    counts = pd.to_numeric(df[idp_col], errors="coerce")
+    mask = _latest_rows(df, counts) & ~_national_rows(df, _state_col(cols))
+
+    levels = {
+        "displacement": (_state_col(cols), _find_col(cols, ["locality", "admin2"], exclude=["origin", "pcode"])),
+        "origin": (_find_origin_col(cols, locality=False), _find_origin_col(cols, locality=True)),
+    }
+
+    records = []
+    for kind, (state_col, locality_col) in levels.items():
+        if not state_col:
+            continue
+        keys = [state_col] + ([locality_col] if locality_col else [])
+        frame = df.loc[mask, keys].copy()
+        frame["idps"] = counts[mask]
+        states = frame[state_col].astype("string").str.strip()
+        frame = frame[states.notna() & (states != "")]
+        if locality_col:
+            names = frame[locality_col].astype("string").str.strip()
+            frame[locality_col] = names.mask(names.isna() | (names == ""), UNKNOWN_LOCALITY)
+        grouped = frame.groupby(keys, sort=False)["idps"].sum().reset_index()
+        for row in grouped.itertuples(index=False):
+            records.append({
+                "kind": kind,
+                "state": str(row[0]).strip(),
+                "locality": str(row[1]).strip() if locality_col else None,
+                "idps": int(row[-1]),
+            })
+    return records
+
+
+def national_total(df, idp_col):
+    """
+    IDP figure of an explicit national-total row in the latest round, or None.
+    A resource without a state column counts as national if it has a single row.
+    """
+    counts = pd.to_numeric(df[idp_col], errors="coerce")
+    mask = _latest_rows(df, counts)
+    state_col = _state_col(df.columns)
+    if state_col:
+        mask &= _national_rows(df, state_col)
+    elif mask.sum() != 1:
+        return None
+    return float(counts[mask].max()) if mask.any() else None
+
+
+def idp_total(df, idp_col, records=None):
+    """
+    Headline IDP figure for the latest round: (total, national, area_sum).
+    An explicit national-total row wins; otherwise the displacement areas are summed.
+    """
+    if records is None:
+        records = aggregate_admin_areas(df, idp_col)
+    national = national_total(df, idp_col)
+    area_sum = sum(r["idps"] for r in records if r["kind"] == "displacement")
+    total = national if national is not None else (area_sum or None)
+    return total, national, area_sum
+
+
+def aggregate_version(records):
+    """
+    Stable short hash of an aggregate, used to key rendered map layers
+    """
+    payload = json.dumps(records, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:12]
+
+
+def state_totals(records, kind):
+    """
+    Per-state totals as a DataFrame sorted descending
+    """
+    df = pd.DataFrame([r for r in records if r["kind"] == kind], columns=["kind", "state", "locality", "idps"])
+    if df.empty:
+        return pd.DataFrame(columns=["state", "idps"])
+    return df.groupby("state", sort=False)["idps"].sum().sort_values(ascending=False).reset_index()
+
+
+def locality_totals(records, kind, state):
+    """
+    Per-locality totals within one state as a DataFrame sorted descending
+    """
+    df = pd.DataFrame([r for r in records if r["kind"] == kind and r["state"] == state and r["locality"]],
+                      columns=["kind", "state", "locality", "idps"])
+    if df.empty:
+        return pd.DataFrame(columns=["locality", "idps"])
+    return df.groupby("locality", sort=False)["idps"].sum().sort_values(ascending=False).reset_index()
+
+
+# -------------------------
+# Boundary shapes & geometry index
+# -------------------------
+def _perp_dist(p, a, b):
+    (x, y), (x1, y1), (x2, y2) = p, a, b
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / ((dx * dx + dy * dy) ** 0.5)
+
+
+def simplify_ring(ring, tolerance):
+    """
+    Douglas-Peucker simplification of a closed ring, rounded to ~10 m
+    """
+    if len(ring) <= 4:
+        return [[round(x, 4), round(y, 4)] for x, y in ring]
+    keep = [False] * len(ring)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        start, end = stack.pop()
+        best, idx = 0.0, None
+        for i in range(start + 1, end):
+            d = _perp_dist(ring[i], ring[start], ring[end])
+            if d > best:
+                best, idx = d, i
+        if idx is not None and best > tolerance:
+            keep[idx] = True
+            stack.append((start, idx))
+            stack.append((idx, end))
+    out = [[round(p[0], 4), round(p[1], 4)] for p, k in zip(ring, keep) if k]
+    if len(out) < 4:
+        return [[round(x, 4), round(y, 4)] for x, y in ring]
+    return out
+
+
+def _simplify_geometry(geom, tolerance):
+    if geom["type"] == "Polygon":
+        return {"type": "Polygon", "coordinates": [simplify_ring(r, tolerance) for r in geom["coordinates"]]}
+    if geom["type"] == "MultiPolygon":
+        return {"type": "MultiPolygon",
+                "coordinates": [[simplify_ring(r, tolerance) for r in poly] for poly in geom["coordinates"]]}
+    return geom
+
+
+def _bbox(geom):
+    rings = geom["coordinates"] if geom["type"] == "Polygon" else [r for p in geom["coordinates"] for r in p]
+    xs = [pt[0] for r in rings for pt in r]
+    ys = [pt[1] for r in rings for pt in r]
+    return [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _merge_bboxes(boxes):
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def load_boundary_index(path, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    Load a local boundary GeoJSON once and return a geometry index:
+    {"features": [{"name", "geometry", "bbox", "parents"}], "lookup": {key: i}, "bbox": [...]}.
+    Keys are normalized names/pcodes; localities are also keyed by (state, locality),
+    since locality names repeat across states.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    features, lookup = [], {}
+    for feat in data.get("features", []):
+        geom = feat.get("geometry")
+        if not geom or geom.get("type") not in ("Polygon", "MultiPolygon"):
+            continue
+        props = feat.get("properties") or {}
+        name = next((props[k] for k in NAME_PROPS if props.get(k)), None)
+        simplified = _simplify_geometry(geom, tolerance)
+        idx = len(features)
+        is_locality = any(props.get(k) for k in ADM2_PROPS)
+        parents = sorted({normalize_name(props[k]) for k in ADM1_PROPS if props.get(k)}) if is_locality else []
+        features.append({"name": name, "geometry": simplified, "bbox": _bbox(simplified), "parents": parents})
+        pcode = next((props[k] for k in PCODE_PROPS if props.get(k)), None)
+        for key in (name, pcode):
+            if key:
+                lookup.setdefault(normalize_name(key), idx)
+                for parent in parents:
+                    lookup.setdefault((parent, normalize_name(key)), idx)
+    if not features:
+        return None
+    return {"features": features, "lookup": lookup, "bbox": _merge_bboxes([f["bbox"] for f in features])}
+
+
+def _lookup(index, name, state=None):
+    if state is None:
+        return index["lookup"].get(normalize_name(name))
+    i = index["lookup"].get((normalize_name(state), normalize_name(name)))
+    if i is None:
+        # Files without state attributes can only be matched by locality name
+        i = index["lookup"].get(normalize_name(name))
+        if i is not None and index["features"][i]["parents"]:
+            return None
+    return i
+
+
+def choropleth_geojson(index, totals, name_col, only_matched=False, state=None):
+    """
+    Join per-area totals onto the indexed shapes as a FeatureCollection with fill colors.
+    With only_matched, shapes without a total are dropped (used for drill-down);
+    `state` restricts locality matches to that state.
+    """
+    values = {}
+    for row in totals.itertuples(index=False):
+        i = _lookup(index, getattr(row, name_col), state)
+        if i is not None:
+            values[i] = values.get(i, 0) + int(row.idps)
+    top = max(values.values()) if values else 0
+    features, boxes = [], []
+    for i, feat in enumerate(index["features"]):
+        v = values.get(i)
+        if v is None and only_matched:
+            continue
+        if v is None:
+            color = NO_DATA_COLOR
+        else:
+            step = min(int(len(COLOR_RAMP) * v / top), len(COLOR_RAMP) - 1) if top else 0
+            color = COLOR_RAMP[step]
+        boxes.append(feat["bbox"])
+        features.append({
+            "type": "Feature",
+            "geometry": feat["geometry"],
+            "properties": {"name": feat["name"], "idps": v or 0, "fill_color": color},
+        })
+    bbox = _merge_bboxes(boxes) if boxes else index["bbox"]
+    return {"type": "FeatureCollection", "bbox": bbox, "features": features}
@@ -0,0 +1,385 @@
+"""
+Bulk historical backfill for the dashboard's snapshot history.
+
+Pulls IOM DTM rounds (HDX), UNHCR yearly refugee populations and OCHA FTS
+monthly HRP funding in parallel batches, rate limited per host, and merges the
+results into the snapshot CSV. Each date is taken from exactly one DTM resource
+or HRP plan, whatever order tasks finish in, so reruns produce the same history. Progress is checkpointed after every batch, so
+an interrupted run resumes where it stopped.
+
+    python backfill.py --year-from 2023 --sources dtm,unhcr,fts
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import argparse
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+import pandas as pd
+
+from snapshots import SNAPSHOT_PATH, upsert_snapshots
+from validation import check_rows, check_total, clean_refugee_rows
+from admin_areas import find_period_col, period_values, idp_total
+
+HDX_CKAN_BASE = "https://data.humdata.org/api/3/action"
+DTM_DATASETS = ["sudan-displacement-situation-idps-iom-dtm", "sudan-displacement-data-idps-iom-dtm"]
+UNHCR_API = "https://api.unhcr.org/population/v1/population"
+FTS_API_V1 = "https://api.hpc.tools/v1/public"
+FTS_API_V2 = "https://api.hpc.tools/v2/public"
+
+CHECKPOINT_PATH = os.environ.get("SPAFS_BACKFILL_CHECKPOINT", "backfill_checkpoint.json")
+DATASTORE_PAGE = 32000
+
+
+# -------------------------
+# HTTP: per-host rate limiting + retries
+# -------------------------
+class RateLimiter:
+    """
+    Token bucket shared by all worker threads hitting the same host
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher:
+    def __init__(self, rate, retries=4):
+        self.rate = rate
+        self.retries = retries
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.limiters:
+                self.limiters[host] = RateLimiter(self.rate)
+            return self.limiters[host]
+
+    def _session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def get_json(self, url, params=None):
+        for attempt in range(self.retries + 1):
+            self._limiter(url).acquire()
+            try:
+                r = self._session().get(url, params=params, timeout=60)
+                if r.status_code == 429 or r.status_code >= 500:
+                    raise requests.HTTPError(f"HTTP {r.status_code}", response=r)
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.retries:
+                    raise
+                retry_after = getattr(getattr(e, "response", None), "headers", {}).get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                time.sleep(delay)
+                continue
+            # Other 4xx responses will not improve on retry
+            r.raise_for_status()
+            return r.json()
+
+
+def safe_get(d, *keys, default=None):
+    x = d
+    for k in keys:
+        if isinstance(x, dict) and k in x:
+            x = x[k]
+        else:
+            return default
+    return x
+
+
+# -------------------------
+# Task discovery: one task per DTM resource, UNHCR year and FTS plan.
+# DTM resources can report the same date; their rows carry a rank and the
+# upsert keeps the lowest, so the result does not depend on completion order.
+# -------------------------
+def dtm_rank(dataset_rank, stamp, resource_id):
+    """
+    Precedence of a DTM resource's rows when several resources report the same date:
+    lower wins. Earlier datasets first, then newer resources, then resource id.
+    Derived from the resource itself, so it is stable across runs and batches.
+    """
+    try:
+        age = -datetime.strptime(stamp, "%Y-%m-%d").toordinal()
+    except ValueError:
+        age = 0
+    return dataset_rank * 1_000_000 + age + zlib.crc32(resource_id.encode("utf-8")) / 2 ** 32
+
+
+def discover_dtm(fetcher, year_from, year_to):
+    tasks = []
+    for dataset_rank, dataset in enumerate(DTM_DATASETS):
+        try:
+            data = fetcher.get_json(f"{HDX_CKAN_BASE}/package_show", params={"id": dataset})
+        except Exception as e:
+            print(f"  ! could not list {dataset}: {e}", file=sys.stderr)
+            continue
+        for res in safe_get(data, "result", "resources", default=[]) or []:
+            if not res.get("datastore_active"):
+                continue
+            stamp = res.get("last_modified") or res.get("created") or ""
+            year = int(stamp[:4]) if stamp[:4].isdigit() else None
+            if year is None or year_from <= year <= year_to:
+                tasks.append({"key": f"dtm:{res['id']}", "source": "dtm", "resource_id": res["id"],
+                              "dataset": dataset, "stamp": stamp[:10],
+                              "rank": dtm_rank(dataset_rank, stamp[:10], res["id"])})
+    return tasks
+
+
+def discover_unhcr(fetcher, year_from, year_to):
+    return [{"key": f"unhcr:{y}", "source": "unhcr", "year": y} for y in range(year_from, year_to + 1)]
+
+
+def discover_fts(fetcher, year_from, year_to):
+    data = fetcher.get_json(f"{FTS_API_V1}/plan/country/SDN")
+    plans, owner = {}, {}
+    for plan in safe_get(data, "data", default=[]) or []:
+        years = [int(y.get("year")) for y in plan.get("years", []) if str(y.get("year", "")).isdigit()]
+        categories = " ".join(c.get("name", "") for c in plan.get("categories", []))
+        name = plan.get("planVersion", {}).get("name") or plan.get("name") or ""
+        is_hrp = "Humanitarian response plan" in categories or "Humanitarian Response Plan" in name
+        if not is_hrp:
+            continue
+        plans[plan["id"]] = plan
+        # Each year's points come from a single plan: the newest HRP covering it
+        for y in years:
+            if year_from <= y <= year_to and plan["id"] > owner.get(y, -1):
+                owner[y] = plan["id"]
+    tasks = []
+    for plan_id in sorted(set(owner.values())):
+        plan = plans[plan_id]
+        tasks.append({"key": f"fts:{plan_id}", "source": "fts", "plan_id": plan_id,
+                      "years": sorted(y for y, p in owner.items() if p == plan_id),
+                      "required": plan.get("origRequirements")})
+    return tasks
+
+
+DISCOVER = {"dtm": discover_dtm, "unhcr": discover_unhcr, "fts": discover_fts}
+
+
+# -------------------------
+# Task runners -> snapshot rows
+# -------------------------
+def _dtm_records(fetcher, resource_id):
+    records, offset = [], 0
+    while True:
+        data = fetcher.get_json(f"{HDX_CKAN_BASE}/datastore_search",
+                                params={"resource_id": resource_id, "limit": DATASTORE_PAGE, "offset": offset})
+        page = safe_get(data, "result", "records", default=[]) or []
+        records.extend(page)
+        total = safe_get(data, "result", "total", default=0) or 0
+        offset += len(page)
+        if not page or offset >= total:
+            break
+    return records
+
+
+def _dtm_point(df, col):
+    """
+    Headline IDP figure for one round, defined as in the app's live getter; None if
+    the round has no usable total or its national row disagrees with the states
+    """
+    clean, _ = check_rows(df, col, "total_idps")
+    total, national, area_sum = idp_total(clean, col)
+    if not total or check_total("total_idps", national, area_sum):
+        return None
+    return int(total)
+
+
+def run_dtm(fetcher, task):
+    records = _dtm_records(fetcher, task["resource_id"])
+    if not records:
+        return []
+    df = pd.DataFrame(records)
+    idp_cols = [c for c in df.columns if "idp" in c.lower() and ("total" in c.lower() or "count" in c.lower())]
+    if not idp_cols:
+        return []
+    col = idp_cols[0]
+    source = f"IOM DTM via HDX ({task['dataset']})"
+    period_col = find_period_col(df.columns)
+    points = {}
+
+    if period_col:
+        # One point per DTM round, dated by the round's latest reporting date (later rounds win a shared date)
+        periods = period_values(df, period_col)
+        date_col = next((c for c in df.columns if "date" in c.lower() and "update" not in c.lower()), None)
+        dates = pd.to_datetime(df[date_col], errors="coerce") if date_col else None
+        for rnd, grp in df.groupby(periods):
+            when = dates[grp.index].max() if dates is not None else pd.NaT
+            day = when.strftime("%Y-%m-%d") if pd.notna(when) else task["stamp"]
+            value = _dtm_point(grp, col)
+            if day and value:
+                label = rnd.strftime("%Y-%m-%d") if hasattr(rnd, "strftime") else f"{rnd:g}"
+                points[day] = {"date": day, "indicator": "total_idps", "value": value,
+                               "source": f"{source} round {label}", "rank": task["rank"]}
+    elif task["stamp"]:
+        value = _dtm_point(df, col)
+        if value:
+            points[task["stamp"]] = {"date": task["stamp"], "indicator": "total_idps", "value": value,
+                                     "source": source, "rank": task["rank"]}
+    return list(points.values())
+
+
+def run_unhcr(fetcher, task):
+    year = task["year"]
+    params = {"coo": "SDN", "yearFrom": year, "yearTo": year, "coa_all": "true", "cf_type": "ISO", "limit": 50000}
+    data = fetcher.get_json(UNHCR_API, params=params)
+    rows = (data or {}).get("data") or (data or {}).get("items") or []
+    if not rows:
+        return []
+    # Same reduction as the app's live figure
+    df, _ = clean_refugee_rows(rows)
+    if df is None:
+        return []
+    total = df["_count"].sum()
+    # UNHCR publishes end-year stocks; the running year is the latest mid-year figure
+    day = f"{year}-12-31" if year < datetime.now().year else datetime.now().strftime("%Y-%m-%d")
+    return [{"date": day, "indicator": "total_refugees", "value": int(total), "source": "UNHCR Refugee Statistics API"}]
+
+
+def run_fts(fetcher, task):
+    data = fetcher.get_json(f"{FTS_API_V1}/fts/flow", params={"planId": task["plan_id"]})
+    flows = safe_get(data, "data", "flows", default=[]) or []
+    df = pd.DataFrame(flows)
+    if df.empty or "amountUSD" not in df.columns or "date" not in df.columns:
+        return []
+    if "boundary" in df.columns:
+        df = df[df["boundary"] == "incoming"]
+    if "status" in df.columns:
+        df = df[df["status"].isin(["paid", "commitment"])]
+    df["month"] = pd.to_datetime(df["date"], errors="coerce", utc=True).dt.tz_localize(None).dt.to_period("M")
+    monthly = df.dropna(subset=["month"]).groupby("month")["amountUSD"].sum().sort_index().cumsum()
+    # Same requirement figure the app displays (original, not revised requirements)
+    plan = fetcher.get_json(f"{FTS_API_V2}/plan/{task['plan_id']}")
+    required = safe_get(plan, "planVersion", "financialRequirements", "originalRequirements") or task.get("required")
+    running = pd.Period(datetime.now(), "M")
+    source = f"OCHA FTS API (plan {task['plan_id']})"
+    rows = []
+    for month, funded in monthly.items():
+        # Flows booked outside the plan's own years (e.g. early pledges) only count towards the cumulative total.
+        # The running month is left to the app's daily snapshots; its month-end date lies in the future.
+        if month.year not in task["years"] or month >= running:
+            continue
+        day = month.to_timestamp(how="end").strftime("%Y-%m-%d")
+        rows.append({"date": day, "indicator": "hrp_funded", "value": float(funded), "source": source})
+        if required:
+            rows.append({"date": day, "indicator": "hrp_required", "value": float(required), "source": source})
+    return rows
+
+
+RUNNERS = {"dtm": run_dtm, "unhcr": run_unhcr, "fts": run_fts}
+
+
+# -------------------------
+# Checkpointing
+# -------------------------
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"done": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(state, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def backfill(sources, year_from, year_to, workers=4, rate=2.0, batch_size=8,
+             snapshot_path=SNAPSHOT_PATH, checkpoint_path=CHECKPOINT_PATH):
+    fetcher = Fetcher(rate)
+    state = load_checkpoint(checkpoint_path)
+    done = set(state.get("done", []))
+
+    tasks = []
+    for source in sources:
+        try:
+            found = DISCOVER[source](fetcher, year_from, year_to)
+        except Exception as e:
+            print(f"! {source}: discovery failed: {e}", file=sys.stderr)
+            continue
+        pending = [t for t in found if t["key"] not in done]
+        print(f"{source}: {len(found)} tasks, {len(pending)} pending")
+        tasks.extend(pending)
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            futures = {pool.submit(RUNNERS[t["source"]], fetcher, t): t for t in batch}
+            rows, finished = [], []
+            for fut in as_completed(futures):
+                task = futures[fut]
+                try:
+                    rows.extend(fut.result())
+                    finished.append(task["key"])
+                except Exception as e:
+                    failed += 1
+                    print(f"  ! {task['key']}: {e}", file=sys.stderr)
+            # Rows land before the checkpoint; a crash in between only repeats an idempotent upsert
+            written = upsert_snapshots(rows, snapshot_path)
+            done.update(finished)
+            state["done"] = sorted(done)
+            save_checkpoint(state, checkpoint_path)
+            print(f"batch {start // batch_size + 1}: {len(finished)}/{len(batch)} tasks, {written} rows")
+    return failed
+
+
+def main(argv=None):
+    this_year = datetime.now().year
+    parser = argparse.ArgumentParser(description="Backfill SPAFS snapshot history from HDX, UNHCR and FTS.")
+    parser.add_argument("--sources", default="dtm,unhcr,fts", help="comma-separated subset of dtm,unhcr,fts")
+    parser.add_argument("--year-from", type=int, default=2023)
+    parser.add_argument("--year-to", type=int, default=this_year)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=2.0, help="max requests per second per host")
+    parser.add_argument("--batch-size", type=int, default=8, help="tasks per checkpointed batch")
+    parser.add_argument("--snapshot-path", default=SNAPSHOT_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args(argv)
+
+    sources = [s.strip() for s in args.sources.split(",") if s.strip()]
+    unknown = [s for s in sources if s not in RUNNERS]
+    if unknown:
+        parser.error(f"unknown source(s): {', '.join(unknown)}")
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    failed = backfill(sources, args.year_from, args.year_to, workers=args.workers, rate=args.rate,
+                      batch_size=args.batch_size, snapshot_path=args.snapshot_path, checkpoint_path=args.checkpoint)
+    if failed:
+        print(f"{failed} task(s) failed; re-run to retry them.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import time
+import pickle
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+
+# =========================
+# Bounded, size-aware cache
+# =========================
+# Process-wide cache for the data getters. Entries are stored pickled, so the
+# byte budget is exact and every hit returns a private copy (callers may mutate
+# it). When the budget or entry cap is exceeded, expired entries go first,
+# then the least recently (lru) or least frequently (lfu) used ones; the entry
+# being inserted is never the victim.
+CACHE_MAX_BYTES = int(float(os.environ.get("SPAFS_CACHE_MAX_MB", "64")) * 1024 * 1024)
+CACHE_MAX_ENTRIES = int(os.environ.get("SPAFS_CACHE_MAX_ENTRIES", "256"))
+CACHE_POLICY = os.environ.get("SPAFS_CACHE_POLICY", "lru").lower()   # "lru" | "lfu"
+
+
+class BoundedCache:
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, policy=CACHE_POLICY):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        self.entries = OrderedDict()   # key -> {"blob", "bytes", "expires", "hits", "created", "tag"}
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "replaced": 0, "oversize": 0}
+        self.lock = threading.Lock()
+        self.inflight = {}
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry["bytes"]
+
+    def get(self, key, tag=None):
+        """
+        Return (True, value) on a live hit, else (False, None). An entry stored
+        with a different tag (e.g. an older file version) is dropped.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] is not None and entry["expires"] <= time.time():
+                self._drop(key)
+                self.counters["expired"] += 1
+                entry = None
+            elif entry is not None and entry["tag"] != tag:
+                self._drop(key)
+                self.counters["replaced"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return False, None
+            entry["hits"] += 1
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+            blob = entry["blob"]
+        return True, pickle.loads(blob)
+
+    def set(self, key, value, ttl=None, tag=None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self.lock:
+            if len(blob) > self.max_bytes:
+                self.counters["oversize"] += 1
+                return
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = {"blob": blob, "bytes": len(blob), "created": now,
+                                 "expires": now + ttl if ttl else None, "hits": 0, "tag": tag}
+            self.bytes += len(blob)
+            self._evict(now, key)
+
+    def _evict(self, now, new_key):
+        if self.bytes <= self.max_bytes and len(self.entries) <= self.max_entries:
+            return
+        for key in [k for k, e in self.entries.items() if e["expires"] is not None and e["expires"] <= now]:
+            self._drop(key)
+            self.counters["expired"] += 1
+        while len(self.entries) > 1 and (self.bytes > self.max_bytes or len(self.entries) > self.max_entries):
+            # The new entry has no hits yet; excluding it keeps fresh data cacheable
+            candidates = (k for k in self.entries if k != new_key)
+            if self.policy == "lfu":
+                # min() keeps the first of equal counts, i.e. the least recently used
+                victim = min(candidates, key=lambda k: self.entries[k]["hits"])
+            else:
+                victim = next(candidates)
+            self._drop(victim)
+            self.counters["evictions"] += 1
+
+    def get_or_compute(self, key, compute, ttl=None, tag=None):
+        """
+        Cached value for key, computing it at most once across concurrent callers
+        """
+        hit, value = self.get(key, tag)
+        if hit:
+            return value
+        with self.lock:
+            key_lock = self.inflight.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                hit, value = self.get(key, tag)
+                if hit:
+                    return value
+                value = compute()
+                self.set(key, value, ttl, tag)
+                return value
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def clear(self, prefix=None):
+        """
+        Drop all entries, or only those whose key starts with `prefix`
+        """
+        with self.lock:
+            for key in [k for k in self.entries if prefix is None or k[0] == prefix]:
+                self._drop(key)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, bytes=self.bytes, entries=len(self.entries),
+                        max_bytes=self.max_bytes, max_entries=self.max_entries, policy=self.policy)
+
+    def entry_table(self):
+        now = time.time()
+        with self.lock:
+            return [
+                {"function": key[0].rsplit(".", 1)[-1], "key": key[1][:160], "bytes": e["bytes"],
+                 "hits": e["hits"], "age_s": round(now - e["created"]),
+                 "expires_in_s": round(e["expires"] - now) if e["expires"] else None}
+                for key, e in self.entries.items()
+            ]
+
+
+shared_cache = BoundedCache()
+
+
+def bounded_cache(ttl=None, cache=shared_cache, replace_on=()):
+    """
+    Memoize a function in the bounded cache. As with st.cache_data, parameters
+    whose name starts with "_" are left out of the key. Parameters named in
+    `replace_on` (versions, mtimes) are not part of the key either: a call with new
+    values replaces the entry instead of adding one. Adds .clear().
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            args_key = tuple((k, v) for k, v in bound.arguments.items() if not k.startswith("_") and k not in replace_on)
+            tag = repr(tuple(bound.arguments[k] for k in replace_on))
+            return cache.get_or_compute((name, repr(args_key)), lambda: func(*args, **kwargs), ttl, tag)
+
+        wrapper.clear = lambda: cache.clear(name)
+        return wrapper
+    return decorator
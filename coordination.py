@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+# =========================
+# Multi-replica coordination
+# =========================
+# With several replicas behind a load balancer, one leader (holder of a lease in
+# a shared SQLite file) runs ingestion and publishes versioned snapshots; every
+# replica renders the latest published snapshot. Upstream load therefore stays
+# at one ingestion per refresh interval no matter how many replicas run.
+# The database must live on a volume shared by all replicas that supports POSIX
+# file locks (a local disk or a shared block volume; not plain NFS).
+COORDINATION_MODE = os.environ.get("SPAFS_COORDINATION", "off").lower()   # "off" | "sqlite"
+COORDINATION_DB = os.environ.get("SPAFS_COORDINATION_DB", "spafs_coordination.db")
+REFRESH_SECONDS = float(os.environ.get("SPAFS_REFRESH_SECONDS", "3600"))
+LEASE_SECONDS = float(os.environ.get("SPAFS_LEASE_SECONDS", "120"))
+KEEP_VERSIONS = 50
+
+REPLICA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Parsed payload of the last version this process read
+_cached = {"version": None, "snapshot": None}
+# Sessions of the same replica share REPLICA_ID, so they also share one ingestion
+_ingest_lock = threading.Lock()
+
+
+def coordination_enabled():
+    return COORDINATION_MODE == "sqlite"
+
+
+def _connect(path=COORDINATION_DB):
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS lease (name TEXT PRIMARY KEY, holder TEXT, expires_at REAL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS snapshots ("
+        " version INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL, leader TEXT, payload TEXT)"
+    )
+    return conn
+
+
+def try_acquire_lease(name="ingest", holder=REPLICA_ID, ttl=LEASE_SECONDS, path=COORDINATION_DB):
+    """
+    Take or renew the named lease. Returns True if this replica holds it.
+    """
+    conn = _connect(path)
+    try:
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT holder, expires_at FROM lease WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] == holder or row[1] < now:
+            conn.execute(
+                "INSERT INTO lease (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at",
+                (name, holder, now + ttl),
+            )
+            conn.execute("COMMIT")
+            return True
+        conn.execute("COMMIT")
+        return False
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        return False
+    finally:
+        conn.close()
+
+
+def publish_snapshot(payload, leader=REPLICA_ID, path=COORDINATION_DB):
+    """
+    Store a new snapshot version and prune old ones. Returns the version number.
+    """
+    conn = _connect(path)
+    try:
+        cur = conn.execute(
+            "INSERT INTO snapshots (created_at, leader, payload) VALUES (?, ?, ?)",
+            (time.time(), leader, json.dumps(payload, ensure_ascii=False)),
+        )
+        version = cur.lastrowid
+        conn.execute("DELETE FROM snapshots WHERE version <= ?", (version - KEEP_VERSIONS,))
+        return version
+    finally:
+        conn.close()
+
+
+def latest_snapshot(path=COORDINATION_DB):
+    """
+    Return {"version", "created_at", "leader", "payload"} for the newest snapshot, or None.
+    The payload is only parsed when the version changes.
+    """
+    conn = _connect(path)
+    try:
+        head = conn.execute("SELECT version, created_at, leader FROM snapshots ORDER BY version DESC LIMIT 1").fetchone()
+        if head is None:
+            return None
+        if _cached["version"] != head[0]:
+            raw = conn.execute("SELECT payload FROM snapshots WHERE version = ?", (head[0],)).fetchone()[0]
+            _cached["snapshot"] = {"version": head[0], "created_at": head[1], "leader": head[2], "payload": json.loads(raw)}
+            _cached["version"] = head[0]
+        return _cached["snapshot"]
+    finally:
+        conn.close()
+
+
+def get_shared_snapshot(ingest, refresh_seconds=REFRESH_SECONDS, path=COORDINATION_DB):
+    """
+    Return the latest published snapshot, running `ingest()` only if this replica
+    wins the lease and the snapshot is older than `refresh_seconds`.
+    Followers keep serving the previous version while the leader refreshes and
+    never wait or fetch themselves: before the first publish they get None.
+    """
+    try:
+        snap = latest_snapshot(path)
+    except sqlite3.Error:
+        # Database unavailable: keep serving what this process read last
+        return _cached["snapshot"]
+    if snap and time.time() - snap["created_at"] < refresh_seconds:
+        return snap
+    try:
+        leader = try_acquire_lease(path=path)
+    except sqlite3.Error:
+        leader = False
+    if not leader:
+        return snap
+    with _ingest_lock:
+        # Another replica or session may have published while we waited
+        try:
+            snap = latest_snapshot(path)
+        except sqlite3.Error:
+            snap = _cached["snapshot"]
+        if snap and time.time() - snap["created_at"] < refresh_seconds:
+            return snap
+        payload = ingest()
+        try:
+            publish_snapshot(payload, path=path)
+            return latest_snapshot(path)
+        except sqlite3.Error:
+            # Serve this ingestion locally; the next leader run publishes again
+            return {"version": None, "created_at": time.time(), "leader": REPLICA_ID, "payload": payload}
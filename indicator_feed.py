@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import fcntl
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# =========================
+# Indicator change feed
+# =========================
+# Append-only JSONL log of indicator changes. Each line is one event holding the
+# full set of current values plus the keys that changed since the previous event.
+# A cursor is the byte offset just past an event, so consumers resume with a
+# single seek instead of re-reading the log.
+FEED_PATH = os.environ.get("SPAFS_FEED_PATH", "indicator_feed.jsonl")
+FEED_HOST = os.environ.get("SPAFS_FEED_HOST", "0.0.0.0")
+FEED_PORT = int(os.environ.get("SPAFS_FEED_PORT", "8502"))
+FEED_POLL_SECONDS = float(os.environ.get("SPAFS_FEED_POLL_SECONDS", "2"))
+FEED_MAX_BATCH = 500
+
+# Last values seen by this process, so unchanged reruns never touch the file
+_last_published = {}
+
+
+def _read_last_event(f):
+    """
+    Return the last complete event in an open feed file, or None
+    """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if end == 0:
+        return None
+    chunk = 4096
+    pos = end
+    buf = b""
+    while pos > 0:
+        step = min(chunk, pos)
+        pos -= step
+        f.seek(pos)
+        buf = f.read(step) + buf
+        lines = buf.rstrip(b"\n").split(b"\n")
+        if len(lines) > 1 or pos == 0:
+            try:
+                return json.loads(lines[-1])
+            except ValueError:
+                return None
+    return None
+
+
+def _drop_partial_line(f):
+    """
+    Truncate an interrupted write (trailing bytes after the last newline) so the
+    next event starts on its own line
+    """
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if end == 0:
+        return
+    f.seek(end - 1)
+    if f.read(1) == b"\n":
+        return
+    pos = end
+    while pos > 0:
+        step = min(4096, pos)
+        pos -= step
+        f.seek(pos)
+        newline = f.read(step).rfind(b"\n")
+        if newline != -1:
+            f.truncate(pos + newline + 1)
+            return
+    f.truncate(0)
+
+
+def publish_indicators(values, sources=None, path=FEED_PATH):
+    """
+    Append an event if any indicator differs from the last published values.
+    Indicators missing from `values` keep their last published value.
+    Returns the new cursor, or None when nothing changed.
+    """
+    values = {k: v for k, v in values.items() if v is not None}
+    if not values or _last_published.get(path) == values:
+        return None
+    with open(path, "a+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            _drop_partial_line(f)
+            last = _read_last_event(f)
+            previous = (last or {}).get("values", {})
+            changes = {
+                k: {"old": previous.get(k), "new": v}
+                for k, v in values.items()
+                if previous.get(k) != v
+            }
+            if not changes:
+                _last_published[path] = values
+                return None
+            f.seek(0, os.SEEK_END)
+            event = {
+                "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "values": {**previous, **values},
+                "changes": changes,
+                "sources": sources or {},
+            }
+            f.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            cursor = f.tell()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    _last_published[path] = values
+    return cursor
+
+
+def read_events(cursor=0, limit=FEED_MAX_BATCH, path=FEED_PATH):
+    """
+    Read up to `limit` events after `cursor`. Returns (events, next_cursor);
+    every event carries its own "cursor" to resume from.
+    """
+    events = []
+    if not os.path.exists(path):
+        return events, 0
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if cursor < 0 or cursor > f.tell():
+            cursor = 0
+        f.seek(cursor)
+        while len(events) < limit:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                # Partial write in progress; pick it up on the next read
+                break
+            cursor += len(line)
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            event["cursor"] = cursor
+            events.append(event)
+    return events, cursor
+
+
+# -------------------------
+# HTTP server: SSE + JSONL
+# -------------------------
+class FeedHandler(BaseHTTPRequestHandler):
+    """
+    GET /events  Server-Sent Events stream (resumes from Last-Event-ID or ?cursor=)
+    GET /feed    JSONL batch after ?cursor=, next cursor in the X-Next-Cursor header
+    """
+
+    def _cursor(self, query):
+        raw = self.headers.get("Last-Event-ID") or (query.get("cursor") or ["0"])[0]
+        try:
+            return int(raw)
+        except ValueError:
+            return 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/feed":
+            self._serve_batch(query)
+        elif url.path == "/events":
+            self._serve_stream(query)
+        else:
+            self.send_error(404)
+
+    def _serve_batch(self, query):
+        events, cursor = read_events(self._cursor(query))
+        body = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in events).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("X-Next-Cursor", str(cursor))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _serve_stream(self, query):
+        cursor = self._cursor(query)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "keep-alive")
+        self.end_headers()
+        try:
+            idle = 0.0
+            while True:
+                events, cursor = read_events(cursor)
+                for e in events:
+                    data = json.dumps(e, ensure_ascii=False)
+                    self.wfile.write(f"id: {e['cursor']}\nevent: indicators\ndata: {data}\n\n".encode("utf-8"))
+                if events:
+                    idle = 0.0
+                else:
+                    idle += FEED_POLL_SECONDS
+                    if idle >= 15:
+                        # Comment line keeps proxies from closing an idle stream
+                        self.wfile.write(b": keep-alive\n\n")
+                        idle = 0.0
+                self.wfile.flush()
+                time.sleep(FEED_POLL_SECONDS)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host=FEED_HOST, port=FEED_PORT):
+    server = ThreadingHTTPServer((host, port), FeedHandler)
+    server.daemon_threads = True
+    print(f"Serving indicator feed from {FEED_PATH} on http://{host}:{port} (/events, /feed)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve()
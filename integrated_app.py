@@ -5,6 +5,20 @@ from datetime import datetime, timezone, date
 import requests
 import pandas as pd
 import streamlit as st
+import pydeck as pdk
+
+from indicator_feed import publish_indicators
+from snapshots import record_daily_snapshot, load_snapshots
+from coordination import coordination_enabled, get_shared_snapshot
+from validation import check_rows, check_total, clean_refugee_rows, validate_indicators
+from reports import FORMATS, ReportWorker, available_formats, report_version
+from profiling import ADMIN_TOKEN, profiler, profiled, process_rss
+from bounded_cache import bounded_cache, shared_cache
+from admin_areas import (
+    STATE_BOUNDARIES_PATH, LOCALITY_BOUNDARIES_PATH, find_period_col, period_values,
+    aggregate_admin_areas, aggregate_version, idp_total, state_totals, locality_totals,
+    load_boundary_index, choropleth_geojson,
+)
 
 # =========================
 # SPAFS Branding & Config
@@ -17,6 +31,7 @@ EVENT_INFO = "Bay Area Fundraiser • Sat, Sept 20, 2025 • USF Theater"
 
 # Data snapshots for trends & delta alerts
 SNAPSHOT_PATH = os.environ.get("SPAFS_SNAPSHOT_PATH", "snapshots.csv")
+SNAPSHOTS_ENABLED = os.environ.get("SPAFS_SNAPSHOTS", "") == "1"   # server setting, not a per-session toggle
 
 # Email alert config (optional)
 SMTP_HOST = os.environ.get("SMTP_HOST", "")
@@ -30,6 +45,15 @@ ALERT_THRESHOLD_REFUGEES = float(os.environ.get("ALERT_THRESHOLD_REFUGEES", "100
 
 st.set_page_config(page_title=f"{ORG_NAME} – Sudan Crisis Dashboard", page_icon="🆘", layout="wide")
 
+# Opt-in rerun profiling (SPAFS_PROFILE=1); a no-op otherwise
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    _ctx = get_script_run_ctx()
+    SESSION_ID = _ctx.session_id if _ctx else "bare"
+except ImportError:
+    SESSION_ID = "unknown"
+profiler.start_rerun(SESSION_ID)
+
 # Custom CSS for styling with borders and rounded corners
 st.markdown("""
 <style>
@@ -139,7 +163,6 @@ T = {
     "kenya": "Kenya",
     "ethiopia": "Ethiopia",
     "alerts": "📣 Email Alerts (optional)",
-    "enable_snap": "Enable daily snapshot persistence (writes to file on server)",
     "email_info": "Configure SMTP_* env vars to send email when jumps exceed thresholds.",
     "no_email": "Email not configured. Set SMTP_HOST/USER/PASS and ALERT_TO to enable.",
     "crisis_numbers": "Sudan Crisis Key Numbers",
@@ -155,7 +178,32 @@ T = {
     "famine_affected": "People Affected by Famine Conditions",
     "displacement_crisis": "Largest Displacement Crisis Globally",
     "health_facilities_non_operational": "Health Facilities Non-operational",
-    "attacks_on_healthcare": "Attacks on Healthcare Facilities"
+    "attacks_on_healthcare": "Attacks on Healthcare Facilities",
+    "idps_by_area": "IDPs by State",
+    "area_view": "Show",
+    "area_displacement": "State of displacement",
+    "area_origin": "State of origin",
+    "drill_down": "Drill down to state",
+    "all_states": "All states",
+    "no_area_data": "State-level breakdown is not available from the current DTM resource.",
+    "no_boundaries": "Set SPAFS_STATE_BOUNDARIES (and optionally SPAFS_LOCALITY_BOUNDARIES) to a local GeoJSON file to show the map.",
+    "reports": "Download Report",
+    "download_pdf": "📄 Download PDF",
+    "download_xlsx": "📊 Download Excel (XLSX)",
+    "report_preparing": "Preparing report…",
+    "report_refresh": "Check again",
+    "initialising": "The dashboard is loading its first data snapshot. Please check again in a moment.",
+    "report_failed": "Report unavailable",
+    "report_kpis": "Key Indicators",
+    "report_history": "Snapshot History",
+    "generated": "Generated (UTC)",
+    "col_indicator": "Indicator",
+    "col_value": "Value",
+    "col_source": "Source",
+    "col_note": "Note",
+    "col_country": "Country",
+    "col_refugees": "Refugees",
+    "col_share": "Share"
   },
   "العربية": {
     "title": "🆘 لوحة مؤشرات أزمة السودان اليومية",
@@ -192,7 +240,6 @@ T = {
     "kenya": "كينيا",
     "ethiopia": "إثيوبيا",
     "alerts": "📣 تنبيهات عبر البريد (اختياري)",
-    "enable_snap": "تفعيل حفظ لقطات يومية (حفظ ملف على الخادم)",
     "email_info": "فعّل متغيرات SMTP_* لإرسال بريد عند تجاوز القيم للعتبات.",
     "no_email": "البريد غير مهيّأ. عيّن SMTP_HOST/USER/PASS و ALERT_TO للتفعيل.",
     "crisis_numbers": "أرقام أزمة السودان الرئيسية",
@@ -208,14 +255,41 @@ T = {
     "famine_affected": "الأشخاص المتأثرون بظروف المجاعة",
     "displacement_crisis": "أكبر أزمة نزوح في العالم",
     "health_facilities_non_operational": "المرافق الصحية غير العاملة",
-    "attacks_on_healthcare": "الهجمات على المرافق الصحية"
+    "attacks_on_healthcare": "الهجمات على المرافق الصحية",
+    "idps_by_area": "النازحون حسب الولاية",
+    "area_view": "عرض",
+    "area_displacement": "ولاية النزوح",
+    "area_origin": "ولاية المنشأ",
+    "drill_down": "التفصيل حسب الولاية",
+    "all_states": "كل الولايات",
+    "no_area_data": "التوزيع حسب الولايات غير متاح من مورد DTM الحالي.",
+    "no_boundaries": "عيّن SPAFS_STATE_BOUNDARIES (واختياريًا SPAFS_LOCALITY_BOUNDARIES) إلى ملف GeoJSON محلي لعرض الخريطة.",
+    "reports": "تنزيل التقرير",
+    "download_pdf": "📄 تنزيل PDF",
+    "download_xlsx": "📊 تنزيل Excel (XLSX)",
+    "report_preparing": "جارٍ إعداد التقرير…",
+    "report_refresh": "تحقق مجددًا",
+    "initialising": "يجري تحميل أول لقطة من البيانات. يرجى المحاولة بعد قليل.",
+    "report_failed": "التقرير غير متاح",
+    "report_kpis": "المؤشرات الرئيسية",
+    "report_history": "سجل اللقطات",
+    "generated": "تاريخ الإنشاء (UTC)",
+    "col_indicator": "المؤشر",
+    "col_value": "القيمة",
+    "col_source": "المصدر",
+    "col_note": "ملاحظة",
+    "col_country": "الدولة",
+    "col_refugees": "اللاجئون",
+    "col_share": "النسبة"
   }
 }
 
 # -------------------------
 # Helpers
 # -------------------------
-@st.cache_data(ttl=300)  # 5 minutes cache
+# Not cached: raw payloads (up to 50k UNHCR rows) are reduced by the getters,
+# and only their compact results are kept in the bounded cache
+@profiled("fetch")
 def fetch_json(url, params=None, headers=None):
     try:
         r = requests.get(url, params=params, headers=headers, timeout=30)
@@ -268,7 +342,8 @@ def fmt_num(n):
 # Robust Data Getters with Specific Sources
 # -------------------------
 
-@st.cache_data(ttl=3600)  # 1 hour cache
+@bounded_cache(ttl=3600)  # 1 hour cache
+@profiled("aggregation")
 def get_sudan_hrp_data():
     """
     Get Sudan HRP 2025 funding data with fallbacks
@@ -318,10 +393,12 @@ def get_sudan_hrp_data():
     return {
         "required": 4160000000,  # $4.16B from Sudan HRP 2025
         "funded": 266240000,     # 6.4% of $4.16B = ~$266.24M from OCHA FTS March 2025
-        "source": "OCHA FTS (March 2025) & Sudan HRP 2025"
+        "source": "OCHA FTS (March 2025) & Sudan HRP 2025",
+        "fallback": True
     }
 
-@st.cache_data(ttl=3600)  # 1 hour cache
+@bounded_cache(ttl=3600)  # 1 hour cache
+@profiled("aggregation")
 def get_idp_data():
     """
     Get IDP data with fallbacks
@@ -372,11 +449,22 @@ def get_idp_data():
                                           if "idp" in col.lower() and ("total" in col.lower() or "count" in col.lower())]
                                 
                                 if idp_cols:
-                                    # Get the latest value
+                                    # Total the validated rows of the latest round: the national
+                                    # row if there is one, else the displacement areas
                                     col = idp_cols[0]
-                                    latest_value = pd.to_numeric(df[col], errors='coerce').dropna().iloc[-1]
+                                    period_col = find_period_col(df.columns)
+                                    period = period_values(df, period_col) if period_col else None
+                                    df, issues = check_rows(df, col, "total_idps", period_col, period)
+                                    admin_areas = aggregate_admin_areas(df, col)
+                                    total, national, area_sum = idp_total(df, col, admin_areas)
+                                    if not total:
+                                        continue
+                                    issues += check_total("total_idps", national, area_sum)
                                     return {
-                                        "total_idps": int(latest_value),
+                                        "total_idps": int(total),
+                                        "admin_areas": admin_areas,
+                                        "admin_version": aggregate_version(admin_areas),
+                                        "issues": issues,
                                         "source": f"IOM DTM via HDX ({dataset_name})"
                                     }
             except Exception as e:
@@ -389,10 +477,15 @@ def get_idp_data():
     # Fallback to documented value with specific source
     return {
         "total_idps": 10900000,  # 10.9 million from IOM DTM October 2024
-        "source": "IOM Displacement Tracking Matrix (October 2024)"
+        "admin_areas": [],
+        "admin_version": None,
+        "issues": [],
+        "source": "IOM Displacement Tracking Matrix (October 2024)",
+        "fallback": True
     }
 
-@st.cache_data(ttl=3600)  # 1 hour cache
+@bounded_cache(ttl=3600)  # 1 hour cache
+@profiled("aggregation")
 def get_refugee_data():
     """
     Get refugee data with fallbacks
@@ -412,27 +505,19 @@ def get_refugee_data():
         data = fetch_json(UNHCR_API, params=params)
         if data:
             rows = data.get("data") or data.get("items") or []
-            total = 0
-            by_asylum = {}
-            for row in rows:
-                # Try different possible fields for refugee count
-                v = row.get("refugees") or row.get("value") or row.get("obs_value") or 0
-                try:
-                    count = int(float(v))
-                    total += count
-                    # Get country of asylum
-                    coa = row.get("coa_iso") or row.get("countryOfAsylum") or row.get("coa") or row.get("coa_name")
-                    if coa:
-                        by_asylum[coa] = by_asylum.get(coa, 0) + count
-                except:
-                    pass
-                    
-            if total > 0:
-                return {
-                    "total_refugees": total,
-                    "by_asylum": by_asylum,
-                    "source": "UNHCR Refugee Statistics API"
-                }
+            # First non-zero count field per row, latest year only, invalid rows dropped
+            df, issues = clean_refugee_rows(rows)
+            if df is not None:
+                total = int(df["_count"].sum())
+                by_asylum = df.dropna(subset=["_coa"]).groupby("_coa")["_count"].sum().astype(int).to_dict()
+
+                if total > 0:
+                    return {
+                        "total_refugees": total,
+                        "by_asylum": by_asylum,
+                        "issues": issues,
+                        "source": "UNHCR Refugee Statistics API"
+                    }
     except Exception as e:
         st.warning(f"Error fetching refugee data: {e}")
     
@@ -448,8 +533,111 @@ def get_refugee_data():
             "KEN": 60000,     # Kenya - 1.7%
             "ETH": 35000      # Ethiopia - 1%
         },
-        "source": "UNHCR Refugee Statistics (October 2024)"
+        "issues": [],
+        "source": "UNHCR Refugee Statistics (October 2024)",
+        "fallback": True
+    }
+
+@bounded_cache(replace_on=("mtime",))
+def _load_snapshot_history(path, mtime):
+    return load_snapshots(path)
+
+def get_snapshot_history():
+    """
+    Snapshot history for validation, re-read only when the file changes
+    """
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    return _load_snapshot_history(SNAPSHOT_PATH, os.path.getmtime(SNAPSHOT_PATH))
+
+def ingest_indicators(fresh=False):
+    """
+    Run all getters, validate the results and publish changes to the indicator feed.
+    fresh=True bypasses the per-replica caches (used by the elected leader).
+    """
+    if fresh:
+        get_sudan_hrp_data.clear()
+        get_idp_data.clear()
+        get_refugee_data.clear()
+    data = {"hrp": get_sudan_hrp_data(), "idp": get_idp_data(), "refugee": get_refugee_data()}
+
+    # Validate before anything is displayed or published; failing values are quarantined
+    fields = {
+        "hrp_required": ("hrp", "required"),
+        "hrp_funded": ("hrp", "funded"),
+        "total_idps": ("idp", "total_idps"),
+        "total_refugees": ("refugee", "total_refugees"),
     }
+    values = {name: data[group].get(key) for name, (group, key) in fields.items()}
+    source_issues = data["idp"].get("issues", []) + data["refugee"].get("issues", [])
+    failed = {i["indicator"] for i in source_issues if i["action"] == "quarantined"}
+    with profiler.section("validation"):
+        accepted, quarantined, issues = validate_indicators(values, get_snapshot_history(), failed)
+    for name, (group, key) in fields.items():
+        data[group][key] = accepted[name]
+    data["validation"] = {
+        "issues": source_issues + issues,
+        "quarantined": quarantined,
+        "checked_at": now_utc(),
+    }
+
+    # Publish changed values to the indicator change feed (no-op when unchanged).
+    # Documented fallback values are not news; they are left out of the feed.
+    live = {name: accepted[name] for name, (group, key) in fields.items() if not data[group].get("fallback")}
+    try:
+        with profiler.section("feed"):
+            publish_indicators(live, sources={"hrp": data["hrp"].get("source"), "idps": data["idp"].get("source"),
+                                              "refugees": data["refugee"].get("source")})
+    except OSError as e:
+        st.warning(f"Could not write indicator feed: {e}")
+    return data
+
+@st.cache_resource
+def get_boundary_index(path, mtime):
+    """
+    Simplified boundary shapes + name index, loaded once per file version
+    """
+    return load_boundary_index(path)
+
+def boundary_index(path):
+    if not path or not os.path.exists(path):
+        return None
+    return get_boundary_index(path, os.path.getmtime(path))
+
+def boundary_versions():
+    """
+    Modification times of the boundary files, so replaced shapes invalidate map layers
+    """
+    return tuple(os.path.getmtime(p) if p and os.path.exists(p) else None
+                 for p in (STATE_BOUNDARIES_PATH, LOCALITY_BOUNDARIES_PATH))
+
+@bounded_cache(replace_on=("version", "boundaries"))
+@profiled("map_geojson")
+def get_admin_geojson(version, boundaries, kind, state, _records):
+    """
+    Pre-aggregated choropleth GeoJSON, shared across sessions per data and boundary version.
+    state=None renders the state level; otherwise that state's localities.
+    """
+    if state is None:
+        index = boundary_index(STATE_BOUNDARIES_PATH)
+        return choropleth_geojson(index, state_totals(_records, kind), "state") if index else None
+    index = boundary_index(LOCALITY_BOUNDARIES_PATH)
+    return choropleth_geojson(index, locality_totals(_records, kind, state), "locality", only_matched=True,
+                              state=state) if index else None
+
+@st.cache_resource
+def get_report_worker():
+    """
+    One background report renderer per process, shared by all sessions
+    """
+    return ReportWorker()
+
+@st.cache_data(ttl=3600)
+def save_daily_snapshot(day, values, sources, quarantined=()):
+    """
+    Write today's values once per (day, values) instead of on every rerun
+    """
+    return record_daily_snapshot(dict(values), dict(sources), SNAPSHOT_PATH, dict(quarantined))
 
 # -------------------------
 # Sidebar (Branding & Actions)
@@ -467,6 +655,44 @@ with st.sidebar:
     st.markdown(f"<p style='font-size: 1.1rem;'>{CONTACT_EMAIL}</p>", unsafe_allow_html=True)
     st.markdown("---")
     st.caption(T[LANG]["sources_caption"])
+profiler.lap("sidebar")
+
+# -------------------------
+# Hidden admin page: profiling (?admin=<SPAFS_ADMIN_TOKEN>)
+# -------------------------
+if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+    st.title("Admin – Rerun & Memory Profile")
+    if not profiler.enabled:
+        st.info("Profiling is off. Set SPAFS_PROFILE=1 and restart the app to record reruns.")
+    cache_stats = shared_cache.stats()
+    cache_entries = pd.DataFrame(shared_cache.entry_table(),
+                                 columns=["function", "key", "bytes", "hits", "age_s", "expires_in_s"])
+    rss = process_rss()
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("Active sessions (5 min)", profiler.active_sessions())
+    m2.metric("Process RSS", f"{fmt_num(rss)}B" if rss else "N/A")
+    m3.metric("Cache footprint", f"{fmt_num(cache_stats['bytes'])}B / {fmt_num(cache_stats['max_bytes'])}B")
+    m4.metric("Reruns recorded", len(profiler.reruns))
+
+    rows = pd.DataFrame(profiler.rerun_rows(), columns=["ts", "session", "stack", "section", "ms", "rerun_ms"])
+    st.subheader("Time per section (ms)")
+    if rows.empty:
+        st.caption("No reruns recorded yet.")
+    else:
+        per_section = rows.groupby("stack")["ms"].describe(percentiles=[0.5, 0.95])[["count", "mean", "50%", "95%", "max"]]
+        st.dataframe(per_section.sort_values("mean", ascending=False).round(2), use_container_width=True)
+        st.subheader("Recent reruns")
+        recent = rows.groupby(["ts", "session"], as_index=False)["rerun_ms"].first().sort_values("ts", ascending=False).head(50)
+        recent["ts"] = pd.to_datetime(recent["ts"], unit="s", utc=True)
+        recent["rerun_ms"] = recent["rerun_ms"].round(2)
+        st.dataframe(recent, hide_index=True, use_container_width=True)
+
+    st.subheader(f"Cache entries ({cache_stats['policy'].upper()}, {cache_stats['entries']}/{cache_stats['max_entries']})")
+    st.caption(", ".join(f"{k}: {cache_stats[k]}" for k in ("hits", "misses", "evictions", "expired", "replaced", "oversize")))
+    st.dataframe(cache_entries.sort_values("bytes", ascending=False), hide_index=True, use_container_width=True)
+    st.download_button("Download flamegraph (folded stacks)", profiler.folded(), file_name="spafs-profile.folded",
+                       mime="text/plain")
+    st.stop()
 
 # -------------------------
 # Main KPIs
@@ -477,16 +703,49 @@ st.markdown(f"<p style='font-size: 1.3rem; font-weight: bold;'>{T[LANG]['byline'
 # Create two rows of metrics with boxed containers
 colA, colB, colC, colD = st.columns(4)
 
-# Get the data
-hrp_data = get_sudan_hrp_data()
-idp_data = get_idp_data()
-refugee_data = get_refugee_data()
+# Get the data (from the shared snapshot when running as one of several replicas)
+data_version = None
+if coordination_enabled():
+    shared = get_shared_snapshot(lambda: ingest_indicators(fresh=True))
+    if not shared:
+        # Followers only read: wait for the leader's first publish instead of fetching upstream
+        st.info(T[LANG]["initialising"])
+        st.button(T[LANG]["report_refresh"], key="initialising_refresh")
+        st.stop()
+    indicators = shared["payload"]
+    data_version = shared["version"]
+else:
+    indicators = ingest_indicators()
+
+hrp_data = indicators["hrp"]
+idp_data = indicators["idp"]
+refugee_data = indicators["refugee"]
 
 required = hrp_data.get("required")
 funded = hrp_data.get("funded")
 idps = idp_data.get("total_idps")
 refugees = refugee_data.get("total_refugees")
 
+if SNAPSHOTS_ENABLED:
+    # Only live values enter the history; fallbacks would skew the change checks
+    live = [(name, value, group) for name, value, group in (
+        ("hrp_required", required, hrp_data), ("hrp_funded", funded, hrp_data),
+        ("total_idps", idps, idp_data), ("total_refugees", refugees, refugee_data),
+    ) if not group.get("fallback")]
+    # Quarantined values are stored raw too, so a genuine new level can be confirmed later
+    held = indicators["validation"]["quarantined"]
+    try:
+        save_daily_snapshot(
+            datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+            tuple((name, value) for name, value, _ in live),
+            tuple((name, group.get("source")) for name, _, group in live),
+            tuple((name, held[name]) for name, _, _ in live if name in held),
+        )
+    except OSError as e:
+        st.warning(f"Could not write snapshot: {e}")
+
+profiler.lap("ingest")
+
 # Calculate percentage
 pct = None
 if required and funded:
@@ -532,115 +791,39 @@ with colD:
         <div class='box-caption'>Source: {refugee_data['source']}</div>
     </div>
     """, unsafe_allow_html=True)
+profiler.lap("kpi_render")
 
 # Additional crisis numbers with boxes
 st.divider()
 st.subheader(T[LANG]["crisis_numbers"])
 
-# First row of crisis numbers
-col1, col2, col3, col4 = st.columns(4)
-with col1:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['people_in_need']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>30.4M</div>
-        <div class='box-caption'>Sudan HRP 2025 Projections</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col2:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['increase_from_2024']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>6.6M</div>
-        <div class='box-caption'>Increase from 2024 projections</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col3:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['children_in_need']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>16M</div>
-        <div class='box-caption'>Children affected</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col4:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['life_saving_aid']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>18.1M</div>
-        <div class='box-caption'>Need life-saving aid</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Crisis numbers: (label key, value, caption), shown four per row
+CRISIS_NUMBERS = [
+    ("people_in_need", "30.4M", "Sudan HRP 2025 Projections"),
+    ("increase_from_2024", "6.6M", "Increase from 2024 projections"),
+    ("children_in_need", "16M", "Children affected"),
+    ("life_saving_aid", "18.1M", "Need life-saving aid"),
+    ("acute_food_insecurity", "25-26M", "IPC Phase 3-5"),
+    ("children_malnutrition", "3.2M", "Under 5 years (2025)"),
+    ("severe_malnutrition", "770K", "SAM cases (2025)"),
+    ("hrp_funding_required", "$4.16B", "Sudan HRP 2025"),
+    ("hrp_funding_received", "6.4%" if funded and required else "—", "As of March 2025"),
+    ("famine_affected", "11M+", "Displaced population"),
+    ("displacement_crisis", "Yes", "World's largest"),
+    ("health_facilities_non_operational", ">70%", "In conflict areas"),
+]
 
-# Second row of crisis numbers
-col5, col6, col7, col8 = st.columns(4)
-with col5:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['acute_food_insecurity']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>25-26M</div>
-        <div class='box-caption'>IPC Phase 3-5</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col6:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['children_malnutrition']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>3.2M</div>
-        <div class='box-caption'>Under 5 years (2025)</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col7:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['severe_malnutrition']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>770K</div>
-        <div class='box-caption'>SAM cases (2025)</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col8:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['hrp_funding_required']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>$4.16B</div>
-        <div class='box-caption'>Sudan HRP 2025</div>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Third row of crisis numbers
-col9, col10, col11, col12 = st.columns(4)
-with col9:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['hrp_funding_received']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>{"6.4%" if funded and required else "—"}</div>
-        <div class='box-caption'>As of March 2025</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col10:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['famine_affected']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>11M+</div>
-        <div class='box-caption'>Displaced population</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col11:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['displacement_crisis']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>Yes</div>
-        <div class='box-caption'>World's largest</div>
-    </div>
-    """, unsafe_allow_html=True)
-with col12:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['health_facilities_non_operational']}</div>
-        <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>>70%</div>
-        <div class='box-caption'>In conflict areas</div>
-    </div>
-    """, unsafe_allow_html=True)
+for start in range(0, len(CRISIS_NUMBERS), 4):
+    for col, (key, value, caption) in zip(st.columns(4), CRISIS_NUMBERS[start:start + 4]):
+        with col:
+            st.markdown(f"""
+            <div class='data-box'>
+                <div style='font-size: 1.5rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG][key]}</div>
+                <div style='font-size: 1.8rem; font-weight: bold; margin: 10px 0;'>{value}</div>
+                <div class='box-caption'>{caption}</div>
+            </div>
+            """, unsafe_allow_html=True)
+profiler.lap("crisis_render")
 
 st.divider()
 
@@ -658,91 +841,78 @@ def get_refugee_count(iso_code, fallback_value):
         return by_asylum[iso_code]
     return fallback_value
 
-# Create columns for all host countries
-countries_cols = st.columns(4)
-
-# Egypt
-with countries_cols[0]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['egypt']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('EGY', 1200000))}</div>
-        <div class='box-caption'>~34% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
-
-# Chad
-with countries_cols[1]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['chad']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('TCD', 980000))}</div>
-        <div class='box-caption'>~28% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
-
-# South Sudan
-with countries_cols[2]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['south_sudan']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('SSD', 840000))}</div>
-        <div class='box-caption'>~24% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
+# Host countries: (label key, ISO3, fallback count, share caption), shown four per row
+HOST_COUNTRIES = [
+    ("egypt", "EGY", 1200000, "~34% of refugees"),
+    ("chad", "TCD", 980000, "~28% of refugees"),
+    ("south_sudan", "SSD", 840000, "~24% of refugees"),
+    ("central_african_republic", "CAF", 175000, "~5% of refugees"),
+    ("uganda", "UGA", 105000, "~3% of refugees"),
+    ("kenya", "KEN", 60000, "~1.7% of refugees"),
+    ("ethiopia", "ETH", 35000, "~1% of refugees"),
+]
+host_boxes = [(T[LANG][key], fmt_num(get_refugee_count(iso, fallback)), caption)
+              for key, iso, fallback, caption in HOST_COUNTRIES]
+host_boxes.append(("Total", fmt_num(refugees) if refugees else '3.5M', "All host countries"))
 
-# Central African Republic (replacing Saudi Arabia)
-with countries_cols[3]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['central_african_republic']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('CAF', 175000))}</div>
-        <div class='box-caption'>~5% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
+for start in range(0, len(host_boxes), 4):
+    for col, (name, value, caption) in zip(st.columns(4), host_boxes[start:start + 4]):
+        with col:
+            st.markdown(f"""
+            <div class='data-box'>
+                <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{name}</div>
+                <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{value}</div>
+                <div class='box-caption'>{caption}</div>
+            </div>
+            """, unsafe_allow_html=True)
+profiler.lap("host_render")
 
-# Second row of host countries
-countries_cols2 = st.columns(4)
+# -------------------------
+# IDPs by State (choropleth with drill-down)
+# -------------------------
+st.divider()
+st.subheader(T[LANG]["idps_by_area"])
 
-# Uganda
-with countries_cols2[0]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['uganda']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('UGA', 105000))}</div>
-        <div class='box-caption'>~3% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
+admin_records = idp_data.get("admin_areas") or []
+admin_version = idp_data.get("admin_version")
+area_kinds = sorted({r["kind"] for r in admin_records})
 
-# Kenya
-with countries_cols2[1]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['kenya']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('KEN', 60000))}</div>
-        <div class='box-caption'>~1.7% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
+if not admin_records:
+    st.caption(T[LANG]["no_area_data"])
+else:
+    kind_labels = {"displacement": T[LANG]["area_displacement"], "origin": T[LANG]["area_origin"]}
+    sel_col1, sel_col2 = st.columns(2)
+    with sel_col1:
+        area_kind = st.radio(T[LANG]["area_view"], area_kinds, format_func=kind_labels.get, horizontal=True)
+    states = state_totals(admin_records, area_kind)
+    with sel_col2:
+        area_state = st.selectbox(T[LANG]["drill_down"], [None] + states["state"].tolist(),
+                                  format_func=lambda x: T[LANG]["all_states"] if x is None else x)
 
-# Ethiopia
-with countries_cols2[2]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>{T[LANG]['ethiopia']}</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(get_refugee_count('ETH', 35000))}</div>
-        <div class='box-caption'>~1% of refugees</div>
-    </div>
-    """, unsafe_allow_html=True)
+    table = states if area_state is None else locality_totals(admin_records, area_kind, area_state)
+    geojson = get_admin_geojson(admin_version, boundary_versions(), area_kind, area_state, admin_records)
 
-# Total
-with countries_cols2[3]:
-    st.markdown(f"""
-    <div class='data-box'>
-        <div style='font-size: 1.3rem; font-weight: bold; margin-bottom: 10px;'>Total</div>
-        <div style='font-size: 1.5rem; font-weight: bold; margin: 10px 0;'>{fmt_num(refugees) if refugees else '3.5M'}</div>
-        <div class='box-caption'>All host countries</div>
-    </div>
-    """, unsafe_allow_html=True)
+    map_col, table_col = st.columns([3, 2])
+    with map_col:
+        if geojson and geojson["features"]:
+            min_x, min_y, max_x, max_y = geojson["bbox"]
+            span = max(max_x - min_x, max_y - min_y, 0.1)
+            zoom = max(min(8.5 - span ** 0.5 * 1.5, 9), 3.5)
+            st.pydeck_chart(pdk.Deck(
+                layers=[pdk.Layer(
+                    "GeoJsonLayer", data=geojson, pickable=True, stroked=True, filled=True,
+                    get_fill_color="properties.fill_color", get_line_color=[255, 255, 255], line_width_min_pixels=1,
+                )],
+                initial_view_state=pdk.ViewState(latitude=(min_y + max_y) / 2, longitude=(min_x + max_x) / 2, zoom=zoom),
+                tooltip={"text": "{name}: {idps}"},
+                map_style=None,
+            ))
+        else:
+            st.caption(T[LANG]["no_boundaries"])
+            st.bar_chart(table.set_index(table.columns[0])["idps"])
+    with table_col:
+        st.dataframe(table, hide_index=True, use_container_width=True)
+profiler.lap("map_render")
 
 # -------------------------
 # Data Source Information
@@ -775,7 +945,93 @@ with st.expander("Data Source Details"):
     </div>
     """, unsafe_allow_html=True)
     
+    validation = indicators.get("validation") or {}
+    st.subheader("Data Quality Checks")
+    for name, value in (validation.get("quarantined") or {}).items():
+        st.error(f"Quarantined {name}: {fmt_num(value)} was rejected; showing the last accepted snapshot value instead.")
+    if validation.get("issues"):
+        st.dataframe(pd.DataFrame(validation["issues"]), hide_index=True, use_container_width=True)
+    else:
+        st.success("All checks passed.")
+    st.caption(f"Checked: {validation.get('checked_at', 'N/A')}")
+
+    if data_version is not None:
+        st.caption(f"Shared snapshot version {data_version} (published by {shared['leader']})")
     st.info("🔄 Data refreshes every hour. Last updated: " + now_utc())
+profiler.lap("diagnostics_render")
+
+# -------------------------
+# Downloadable report (PDF / XLSX, rendered in the background)
+# -------------------------
+st.subheader(T[LANG]["reports"])
+
+history = get_snapshot_history()
+history_rows = []
+if history is not None and not history.empty:
+    wide = history.pivot_table(index="date", columns="indicator", values="value", aggfunc="last").reset_index()
+    history_rows = wide.astype(object).where(wide.notna(), None).to_dict("records")
+
+report = {
+    "rtl": LANG == "العربية",
+    "generated": now_utc(),
+    "labels": {
+        "title": T[LANG]["title"],
+        "byline": T[LANG]["byline"],
+        "generated": T[LANG]["generated"],
+        "kpis": T[LANG]["report_kpis"],
+        "crisis": T[LANG]["crisis_numbers"],
+        "hosts": T[LANG]["host_country_stats"],
+        "history": T[LANG]["report_history"],
+        "sources": T[LANG]["sources_caption"],
+        "columns": {
+            "kpis": [T[LANG]["col_indicator"], T[LANG]["col_value"], T[LANG]["col_source"]],
+            "crisis": [T[LANG]["col_indicator"], T[LANG]["col_value"], T[LANG]["col_note"]],
+            "hosts": [T[LANG]["col_country"], T[LANG]["col_refugees"], T[LANG]["col_share"]],
+        },
+    },
+    "kpis": [
+        [f"Sudan HRP 2025 – {T[LANG]['requirements']}", f"${fmt_num(required)}" if required else "—", hrp_data["source"]],
+        [T[LANG]["funding"], f"${fmt_num(funded)}" if funded else "—", hrp_data["source"]],
+        [T[LANG]["idps"], fmt_num(idps) if idps else "—", idp_data["source"]],
+        [T[LANG]["refugees"], fmt_num(refugees) if refugees else "—", refugee_data["source"]],
+    ],
+    "crisis": [[T[LANG][key], value, caption] for key, value, caption in CRISIS_NUMBERS],
+    "hosts": [list(box) for box in host_boxes],
+    "history": history_rows,
+}
+# Versioned by the data only; the language is part of the file name
+report_key = report_version({
+    "kpis": [[required, hrp_data["source"]], [funded, hrp_data["source"]],
+             [idps, idp_data["source"]], [refugees, refugee_data["source"]]],
+    "crisis": CRISIS_NUMBERS,
+    "hosts": [[iso, get_refugee_count(iso, fallback), caption] for _, iso, fallback, caption in HOST_COUNTRIES],
+    "history": history_rows,
+})
+report_lang = "ar" if report["rtl"] else "en"
+worker = get_report_worker()
+
+# Without a font that has Arabic glyphs the Arabic PDF is not offered
+report_formats = available_formats(report_lang)
+report_cols = st.columns(len(report_formats))
+for col, fmt in zip(report_cols, report_formats):
+    with col:
+        status, result = worker.request(report, report_key, report_lang, fmt)
+        if status == "ready":
+            try:
+                with open(result, "rb") as f:
+                    payload = f.read()
+            except OSError:
+                # Removed by pruning after the check; the next request renders it again
+                status = "pending"
+            else:
+                st.download_button(T[LANG][f"download_{fmt}"], payload, file_name=os.path.basename(result),
+                                   mime=FORMATS[fmt], key=f"report_{fmt}")
+        if status == "pending":
+            st.caption(T[LANG]["report_preparing"])
+            st.button(T[LANG]["report_refresh"], key=f"report_refresh_{fmt}")
+        elif status == "failed":
+            st.caption(f"{T[LANG]['report_failed']}: {result}")
+profiler.lap("report")
 
 # -------------------------
 # Tabs for additional information
@@ -823,3 +1079,5 @@ with tab2:
     </div>
     """, unsafe_allow_html=True)
     st.link_button("Learn More About SPAFS", "https://spafs.org")
+
+profiler.end_rerun("tabs_render")
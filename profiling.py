@@ -0,0 +1,169 @@
+import os
+import time
+import threading
+import functools
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+# =========================
+# Opt-in rerun profiler
+# =========================
+# Records per-rerun wall time by section and active sessions; cache footprint
+# comes from the bounded cache itself. Section times are kept as folded stacks
+# ("rerun;ingest;fetch"), so they can be dumped straight into flamegraph.pl or
+# speedscope. Disabled unless SPAFS_PROFILE=1; then every call is a no-op.
+PROFILE_ENABLED = os.environ.get("SPAFS_PROFILE", "") == "1"
+ADMIN_TOKEN = os.environ.get("SPAFS_ADMIN_TOKEN", "")
+MAX_RERUNS = int(os.environ.get("SPAFS_PROFILE_MAX_RERUNS", "500"))
+SESSION_IDLE_SECONDS = 300
+
+
+def process_rss():
+    """
+    Current resident set size of this process in bytes (Linux), or None
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Profiler:
+    def __init__(self, enabled=PROFILE_ENABLED, max_reruns=MAX_RERUNS):
+        self.enabled = enabled
+        self.reruns = deque(maxlen=max_reruns)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # -------------------------
+    # Rerun timing
+    # -------------------------
+    def start_rerun(self, session_id):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.local.rerun = {"session": session_id, "ts": time.time(), "started": now, "stacks": defaultdict(float)}
+        self.local.stack = []
+        self.local.child_time = []
+        self.local.lap_start = now
+        self.local.lap_children = 0.0
+        self.local.pending = defaultdict(float)
+        with self.lock:
+            self.sessions[session_id] = time.time()
+            self._prune_sessions()
+
+    @contextmanager
+    def section(self, name):
+        """
+        Time a nested section inside the current lap (used inside functions)
+        """
+        if not self.enabled or getattr(self.local, "rerun", None) is None:
+            yield
+            return
+        self.local.stack.append(name)
+        self.local.child_time.append(0.0)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            path = ";".join(self.local.stack)
+            self.local.stack.pop()
+            children = self.local.child_time.pop()
+            self.local.pending[path] += elapsed - children
+            if self.local.child_time:
+                self.local.child_time[-1] += elapsed
+            else:
+                self.local.lap_children += elapsed
+
+    def lap(self, name):
+        """
+        Attribute the time since the previous lap to a top-level section; nested
+        sections recorded meanwhile are placed under it
+        """
+        if not self.enabled or getattr(self.local, "rerun", None) is None:
+            return
+        now = time.perf_counter()
+        stacks = self.local.rerun["stacks"]
+        stacks[f"rerun;{name}"] += (now - self.local.lap_start) - self.local.lap_children
+        for path, seconds in self.local.pending.items():
+            stacks[f"rerun;{name};{path}"] += seconds
+        self.local.pending.clear()
+        self.local.lap_children = 0.0
+        self.local.lap_start = now
+
+    def end_rerun(self, name="other"):
+        if not self.enabled or getattr(self.local, "rerun", None) is None:
+            return
+        self.lap(name)
+        rerun = self.local.rerun
+        self.local.rerun = None
+        record = {
+            "session": rerun["session"],
+            "ts": rerun["ts"],
+            "total": time.perf_counter() - rerun["started"],
+            "stacks": dict(rerun["stacks"]),
+        }
+        with self.lock:
+            self.reruns.append(record)
+
+    # -------------------------
+    # Sessions
+    # -------------------------
+    def _prune_sessions(self):
+        # Caller holds self.lock; idle sessions are forgotten so the table stays bounded
+        cutoff = time.time() - SESSION_IDLE_SECONDS
+        for session_id in [s for s, seen in self.sessions.items() if seen < cutoff]:
+            del self.sessions[session_id]
+
+    def active_sessions(self):
+        with self.lock:
+            self._prune_sessions()
+            return len(self.sessions)
+
+    # -------------------------
+    # Export
+    # -------------------------
+    def rerun_rows(self):
+        """
+        One row per (rerun, stack) with milliseconds, for tabulating
+        """
+        with self.lock:
+            reruns = list(self.reruns)
+        return [
+            {"ts": r["ts"], "session": r["session"], "stack": stack, "section": stack.rsplit(";", 1)[-1],
+             "ms": seconds * 1000, "rerun_ms": r["total"] * 1000}
+            for r in reruns for stack, seconds in r["stacks"].items()
+        ]
+
+    def folded(self):
+        """
+        Folded stacks ("frame;frame value" per line, value in microseconds) summed over all reruns
+        """
+        totals = defaultdict(float)
+        with self.lock:
+            for r in self.reruns:
+                for stack, seconds in r["stacks"].items():
+                    totals[stack] += seconds
+        return "".join(f"{stack} {int(seconds * 1_000_000)}\n" for stack, seconds in sorted(totals.items()) if seconds > 0)
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """
+    Time a function as a nested section. Placed under a cache decorator it only
+    runs (and is only timed) on a cache miss.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            with profiler.section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,267 @@
+import os
+import io
+import json
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# =========================
+# Downloadable reports (PDF / XLSX)
+# =========================
+# Reports are rendered off the request path by a small worker pool and written
+# to disk once per (data version, language, format). Concurrent requests for
+# the same report share one job; later requests are served from the file. Only
+# the most recently requested versions are kept on disk.
+REPORT_DIR = os.environ.get("SPAFS_REPORT_DIR", "reports")
+# Installed fonts (Debian/Ubuntu, Fedora, Arch paths) known to carry Arabic glyphs, in order of preference
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSansArabic-Regular.ttf",
+    "/usr/share/fonts/google-noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/noto/NotoNaskhArabic-Regular.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu-sans-fonts/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSerif.ttf",
+]
+
+
+def find_report_font():
+    """
+    SPAFS_REPORT_FONT if set, else the first installed candidate font ("" if none)
+    """
+    configured = os.environ.get("SPAFS_REPORT_FONT", "")
+    if configured:
+        return configured
+    return next((path for path in FONT_CANDIDATES if os.path.exists(path)), "")
+
+
+REPORT_FONT = find_report_font()   # TTF with Arabic glyphs, e.g. NotoNaskhArabic-Regular.ttf
+REPORT_WORKERS = int(os.environ.get("SPAFS_REPORT_WORKERS", "2"))
+REPORT_KEEP_VERSIONS = int(os.environ.get("SPAFS_REPORT_KEEP_VERSIONS", "3"))
+REPORT_PREFIX = "spafs-report-"
+
+FORMATS = {
+    "pdf": "application/pdf",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def report_version(data):
+    """
+    Short hash of the data behind a report. Pass only language-independent values
+    (no labels or generation time), so every language of one data version shares it.
+    """
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:12]
+
+
+def available_formats(lang, font_path=REPORT_FONT):
+    """
+    Formats that can be rendered for a language; Arabic PDFs need a font with Arabic glyphs
+    """
+    has_font = bool(font_path) and os.path.exists(font_path)
+    return [fmt for fmt in FORMATS if not (fmt == "pdf" and lang == "ar" and not has_font)]
+
+
+# -------------------------
+# Builders
+# -------------------------
+def build_xlsx(report):
+    """
+    Workbook with one sheet per section plus the snapshot history
+    """
+    from openpyxl import Workbook
+    from openpyxl.styles import Font
+
+    wb = Workbook()
+    rtl = report.get("rtl", False)
+    sections = [("kpis", report["kpis"]), ("crisis", report["crisis"]), ("hosts", report["hosts"])]
+    ws = wb.active
+    for i, (key, rows) in enumerate(sections):
+        if i:
+            ws = wb.create_sheet()
+        ws.title = report["labels"][key][:31]
+        ws.sheet_view.rightToLeft = rtl
+        ws.append(report["labels"]["columns"][key])
+        for cell in ws[1]:
+            cell.font = Font(bold=True)
+        for row in rows:
+            ws.append(list(row))
+        ws.column_dimensions["A"].width = 48
+        ws.column_dimensions["B"].width = 18
+        ws.column_dimensions["C"].width = 48
+
+    history = report.get("history") or []
+    if history:
+        ws = wb.create_sheet(report["labels"]["history"][:31])
+        ws.sheet_view.rightToLeft = rtl
+        columns = list(history[0].keys())
+        ws.append(columns)
+        for cell in ws[1]:
+            cell.font = Font(bold=True)
+        for row in history:
+            ws.append([row.get(c) for c in columns])
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _clean(text, unicode_font):
+    text = str(text)
+    if not unicode_font:
+        # Core PDF fonts only cover Latin-1
+        text = text.replace("—", "-").replace("–", "-")
+        return text.encode("latin-1", "ignore").decode("latin-1").strip()
+    # Drop emoji / pictographs, which text fonts do not carry
+    return "".join(ch for ch in text if unicodedata.category(ch) != "So" and ord(ch) <= 0xFFFF).strip()
+
+
+def build_pdf(report, font_path=REPORT_FONT):
+    """
+    One-page PDF: headline KPIs, crisis numbers and host-country breakdown
+    """
+    from fpdf import FPDF
+
+    rtl = report.get("rtl", False)
+    unicode_font = bool(font_path) and os.path.exists(font_path)
+    if rtl and not unicode_font:
+        raise RuntimeError("Arabic PDF reports need SPAFS_REPORT_FONT set to a TTF font with Arabic glyphs.")
+
+    pdf = FPDF(format="A4")
+    pdf.set_auto_page_break(True, margin=12)
+    pdf.add_page()
+    if unicode_font:
+        # Register the face for bold too; table headings are bold by default
+        pdf.add_font("report", "", font_path)
+        pdf.add_font("report", "B", font_path)
+        family = "report"
+        if rtl:
+            pdf.set_text_shaping(use_shaping_engine=True, direction="rtl", script="arab", language="ara")
+    else:
+        family = "helvetica"
+    align = "R" if rtl else "L"
+
+    def line(text, size=10, style="", h=6):
+        pdf.set_font(family, style, size)
+        pdf.multi_cell(0, h, _clean(text, unicode_font), align=align, new_x="LMARGIN", new_y="NEXT")
+
+    def table(title, rows):
+        pdf.ln(3)
+        line(title, 13, "B", 8)
+        pdf.set_font(family, "", 9)
+        widths = (2.2, 1.3, 3) if rtl else (3, 1.3, 2.2)
+        with pdf.table(col_widths=widths, text_align=("RIGHT" if rtl else "LEFT"), line_height=5.5) as t:
+            for row in rows:
+                r = t.row()
+                cells = [_clean(c, unicode_font) for c in row]
+                for c in (reversed(cells) if rtl else cells):
+                    r.cell(c)
+
+    labels = report["labels"]
+    line(labels["title"], 16, "B", 9)
+    line(labels["byline"], 10)
+    line(f"{labels['generated']}: {report['generated']}", 9)
+    table(labels["kpis"], [labels["columns"]["kpis"]] + [list(r) for r in report["kpis"]])
+    table(labels["crisis"], [labels["columns"]["crisis"]] + [list(r) for r in report["crisis"]])
+    table(labels["hosts"], [labels["columns"]["hosts"]] + [list(r) for r in report["hosts"]])
+    pdf.ln(3)
+    line(labels["sources"], 8)
+    return bytes(pdf.output())
+
+
+BUILDERS = {"pdf": build_pdf, "xlsx": build_xlsx}
+
+
+# -------------------------
+# Background worker
+# -------------------------
+class ReportWorker:
+    """
+    Deduplicating background renderer with an on-disk cache per version/language/format
+    """
+
+    def __init__(self, out_dir=REPORT_DIR, workers=REPORT_WORKERS, keep_versions=REPORT_KEEP_VERSIONS):
+        self.out_dir = out_dir
+        self.keep_versions = keep_versions
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spafs-report")
+        self.jobs = {}
+        self.versions = OrderedDict()   # recently requested versions, oldest first
+        self.lock = threading.Lock()
+
+    def path(self, version, lang, fmt):
+        return os.path.join(self.out_dir, f"{REPORT_PREFIX}{version}-{lang}.{fmt}")
+
+    def _render(self, report, path, fmt):
+        os.makedirs(self.out_dir, exist_ok=True)
+        data = BUILDERS[fmt](report)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._prune()
+        return path
+
+    def _touch(self, version):
+        """
+        Mark a version as recently requested and forget finished jobs of versions
+        that fell out of the window
+        """
+        with self.lock:
+            self.versions[version] = True
+            self.versions.move_to_end(version)
+            while len(self.versions) > self.keep_versions:
+                self.versions.popitem(last=False)
+            for key in [k for k, job in self.jobs.items() if k[0] not in self.versions and job.done()]:
+                del self.jobs[key]
+
+    def _prune(self):
+        """
+        Delete report files (and leftover temp files) of versions outside the window
+        """
+        with self.lock:
+            keep = set(self.versions)
+        try:
+            names = os.listdir(self.out_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(REPORT_PREFIX) and name[len(REPORT_PREFIX):].split("-", 1)[0] not in keep:
+                try:
+                    os.remove(os.path.join(self.out_dir, name))
+                except OSError:
+                    pass
+
+    def request(self, report, version, lang, fmt):
+        """
+        Ensure a render is queued or done. Returns ("ready", path), ("pending", None)
+        or ("failed", error message); never blocks on rendering.
+        """
+        path = self.path(version, lang, fmt)
+        key = (version, lang, fmt)
+        self._touch(version)
+        if os.path.exists(path):
+            with self.lock:
+                self.jobs.pop(key, None)
+            return "ready", path
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.pool.submit(self._render, report, path, fmt)
+                self.jobs[key] = job
+        if not job.done():
+            return "pending", None
+        # Failures stay recorded for this version so reruns do not resubmit them
+        error = job.exception()
+        if error is not None:
+            return "failed", str(error)
+        if not os.path.exists(job.result()):
+            # Pruned while the version was briefly out of the window; render it again
+            with self.lock:
+                if self.jobs.get(key) is job:
+                    self.jobs[key] = self.pool.submit(self._render, report, path, fmt)
+            return "pending", None
+        return "ready", job.result()
@@ -0,0 +1,87 @@
+import os
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import pandas as pd
+
+# =========================
+# Snapshot storage
+# =========================
+# Long-format CSV: one row per (date, indicator). "value" is what was displayed;
+# "raw" is what the source reported, which differs when validation quarantined it.
+# Writers take an exclusive lock and replace the file atomically, so the app, the
+# backfill job and readers never see a half-written file.
+SNAPSHOT_PATH = os.environ.get("SPAFS_SNAPSHOT_PATH", "snapshots.csv")
+SNAPSHOT_COLUMNS = ["date", "indicator", "value", "raw", "quarantined", "source", "rank", "recorded_at"]
+
+
+@contextmanager
+def _locked(path):
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _normalize(df):
+    df = df.reindex(columns=SNAPSHOT_COLUMNS)
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    # Rows from older files and from the backfill were never quarantined
+    df["raw"] = pd.to_numeric(df["raw"], errors="coerce").fillna(df["value"])
+    df["quarantined"] = df["quarantined"].astype(str).str.lower().eq("true")
+    df["rank"] = pd.to_numeric(df["rank"], errors="coerce")
+    return df
+
+
+def load_snapshots(path=SNAPSHOT_PATH):
+    """
+    Read the snapshot history as a DataFrame (empty if nothing recorded yet)
+    """
+    if not os.path.exists(path):
+        return _normalize(pd.DataFrame(columns=SNAPSHOT_COLUMNS))
+    df = pd.read_csv(path, dtype={"date": str, "indicator": str, "source": str, "recorded_at": str})
+    return _normalize(df)
+
+
+def upsert_snapshots(rows, path=SNAPSHOT_PATH):
+    """
+    Merge rows ({"date", "indicator", "value", "source"}, optionally "raw",
+    "quarantined" and "rank") into the history. For the same (date, indicator) the
+    lowest rank wins, rows without a rank (the app's own snapshots) beat ranked
+    backfill rows, and among equals the later write wins. Returns the number of rows written.
+    """
+    if not rows:
+        return 0
+    stamp = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    new = _normalize(pd.DataFrame(rows))
+    new["recorded_at"] = new["recorded_at"].fillna(stamp)
+    new = new.dropna(subset=["date", "indicator", "value"])
+    with _locked(path):
+        merged = pd.concat([load_snapshots(path), new], ignore_index=True)
+        # Winner last: highest rank first, then write order
+        precedence = merged["rank"].fillna(float("-inf"))
+        merged = merged.iloc[precedence.sort_values(ascending=False, kind="stable").index]
+        merged = merged.drop_duplicates(subset=["date", "indicator"], keep="last")
+        merged = merged.sort_values(["indicator", "date"], kind="stable")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        merged.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+    return len(new)
+
+
+def record_daily_snapshot(values, sources=None, path=SNAPSHOT_PATH, quarantined=None):
+    """
+    Store today's displayed indicator values (UTC date), overwriting earlier runs of
+    the same day. `quarantined` maps indicators held back by validation to the raw value.
+    """
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    sources = sources or {}
+    quarantined = quarantined or {}
+    rows = [
+        {"date": today, "indicator": k, "value": v, "raw": quarantined.get(k, v),
+         "quarantined": k in quarantined, "source": sources.get(k, "")}
+        for k, v in values.items() if v is not None
+    ]
+    return upsert_snapshots(rows, path)
@@ -0,0 +1,190 @@
+import os
+import pandas as pd
+
+# =========================
+# Data-quality validation
+# =========================
+# Runs between ingestion and display. Row checks clean the raw records before
+# they are totalled; indicator checks gate each headline number against fixed
+# ranges and the snapshot history. Values that fail are quarantined: the last
+# accepted snapshot value is shown instead and the reason goes to diagnostics.
+MAX_PCT_CHANGE = float(os.environ.get("SPAFS_MAX_PCT_CHANGE", "0.5"))   # vs previous snapshot
+MAX_ZSCORE = float(os.environ.get("SPAFS_MAX_ZSCORE", "4"))             # vs historical day-to-day changes
+MIN_PCT_CHANGE = float(os.environ.get("SPAFS_MIN_PCT_CHANGE", "0.1"))   # smaller changes always pass
+# A jump is accepted once this many daily snapshots have quarantined (nearly) the same raw value
+QUARANTINE_CONFIRMATIONS = int(os.environ.get("SPAFS_QUARANTINE_CONFIRMATIONS", "2"))
+MAX_TOTAL_MISMATCH = float(os.environ.get("SPAFS_MAX_TOTAL_MISMATCH", "0.05"))  # national row vs sum of areas
+MIN_HISTORY_FOR_ZSCORE = 5
+
+# Plausible bounds per indicator (inclusive)
+RANGES = {
+    "hrp_required": (1e8, 2e10),
+    "hrp_funded": (0, 2e10),
+    "total_idps": (1e5, 2.5e7),
+    "total_refugees": (1e4, 1.5e7),
+}
+
+
+def issue(indicator, check, detail, action):
+    return {"indicator": indicator, "check": check, "detail": detail, "action": action}
+
+
+# -------------------------
+# Row-level checks
+# -------------------------
+def check_rows(df, value_col, indicator, period_col=None, period=None):
+    """
+    Drop rows with missing/negative values, duplicate rows and rows outside
+    the latest period. `period` is an optional pre-parsed Series for `period_col`.
+    Returns (clean_df, issues).
+    """
+    issues = []
+    values = pd.to_numeric(df[value_col], errors="coerce")
+
+    bad = values.isna() | (values < 0)
+    if bad.any():
+        issues.append(issue(indicator, "range", f"{int(bad.sum())} row(s) with missing or negative {value_col}", "dropped rows"))
+
+    # CKAN adds a unique _id (and other _-prefixed fields) to every record; compare the data columns only
+    subset = [c for c in df.columns if not str(c).startswith("_")] or list(df.columns)
+    try:
+        dupes = df.duplicated(subset=subset)
+    except TypeError:
+        # Nested values (dicts/lists) are unhashable; compare their text form
+        dupes = df[subset].astype(str).duplicated()
+    if dupes.any():
+        issues.append(issue(indicator, "duplicates", f"{int(dupes.sum())} duplicate row(s)", "dropped rows"))
+
+    keep = ~bad & ~dupes
+    if period_col is not None:
+        if period is None:
+            period = df[period_col]
+        distinct = period[keep].dropna().unique()
+        if len(distinct) > 1:
+            latest = period[keep].max()
+            stale = keep & (period != latest)
+            issues.append(issue(
+                indicator, "period consistency",
+                f"rows span {len(distinct)} values of {period_col}; only {latest} is counted ({int(stale.sum())} row(s) excluded)",
+                "dropped rows",
+            ))
+            keep &= period == latest
+
+    clean = df[keep].copy()
+    clean[value_col] = values[keep]
+    return clean, issues
+
+
+def check_total(indicator, total, parts):
+    """
+    Compare a reported national total with the sum of its areas. Returns a
+    "quarantined" issue when they disagree by more than MAX_TOTAL_MISMATCH.
+    """
+    if total is None or not parts or abs(total - parts) <= MAX_TOTAL_MISMATCH * abs(total):
+        return []
+    return [issue(indicator, "total vs areas", f"national total {total:,.0f} but areas sum to {parts:,.0f}", "quarantined")]
+
+
+def clean_refugee_rows(rows):
+    """
+    UNHCR population rows reduced the way the dashboard counts them: "_count" is the
+    first non-zero of refugees/value/obs_value, "_coa" the country of asylum, and only
+    valid rows of the latest year are kept. Returns (df, issues), or (None, []) when
+    the rows carry no count column.
+    """
+    df = pd.DataFrame(rows)
+    value_cols = [c for c in ("refugees", "value", "obs_value") if c in df.columns]
+    if not value_cols:
+        return None, []
+    counts = df[value_cols].apply(pd.to_numeric, errors="coerce")
+    # Rows with no parseable count stay NaN so the row checks drop and report them
+    first_nonzero = counts.where(counts != 0).bfill(axis=1).iloc[:, 0]
+    df["_count"] = first_nonzero.fillna(counts.bfill(axis=1).iloc[:, 0])
+    coa_cols = [c for c in ("coa_iso", "countryOfAsylum", "coa", "coa_name") if c in df.columns]
+    df["_coa"] = df[coa_cols].where(df[coa_cols] != "").bfill(axis=1).iloc[:, 0] if coa_cols else None
+    # Populations are stocks: count only the latest year, never sum across years
+    year_col = "year" if "year" in df.columns else None
+    return check_rows(df, "_count", "total_refugees", year_col)
+
+
+# -------------------------
+# Indicator-level checks
+# -------------------------
+def history_stats(history):
+    """
+    Per-indicator last value and mean/std/count of day-to-day changes from the snapshot history
+    """
+    if history is None or history.empty:
+        return pd.DataFrame(columns=["last", "diff_mean", "diff_std", "diff_count"])
+    h = history.dropna(subset=["value"]).sort_values(["indicator", "date"], kind="stable")
+    diffs = h.groupby("indicator")["value"].diff()
+    grouped = diffs.groupby(h["indicator"])
+    return pd.DataFrame({
+        "last": h.groupby("indicator")["value"].last(),
+        "diff_mean": grouped.mean(),
+        "diff_std": grouped.std(),
+        "diff_count": grouped.count(),
+    })
+
+
+def confirmations(history, indicator, value):
+    """
+    Number of latest consecutive snapshots that quarantined a raw value within
+    MIN_PCT_CHANGE of `value`
+    """
+    if history is None or history.empty:
+        return 0
+    h = history[history["indicator"] == indicator].sort_values("date", kind="stable")
+    count = 0
+    for raw, flagged in zip(h["raw"].iloc[::-1], h["quarantined"].iloc[::-1]):
+        if not flagged or pd.isna(raw) or abs(raw - value) > MIN_PCT_CHANGE * abs(value):
+            break
+        count += 1
+    return count
+
+
+def validate_indicators(values, history=None, failed=()):
+    """
+    Gate headline values. Returns (accepted, quarantined, issues): accepted maps each
+    indicator to the value to display, quarantined maps failing indicators to the
+    rejected value. Indicators in `failed` were already rejected by source-level
+    checks, which report their own issues. A jump that persists across
+    QUARANTINE_CONFIRMATIONS snapshots is accepted as the new level.
+    """
+    current = pd.Series({k: v for k, v in values.items() if v is not None}, dtype="float64")
+    stats = history_stats(history).reindex(current.index)
+    bounds = pd.DataFrame(RANGES, index=["lo", "hi"]).T.reindex(current.index)
+
+    out_of_range = (current < bounds["lo"]) | (current > bounds["hi"])
+
+    change = current - stats["last"]
+    pct = (change.abs() / stats["last"].abs()).where(stats["last"] != 0)
+    zscore = ((change - stats["diff_mean"]) / stats["diff_std"]).where(
+        (stats["diff_count"] >= MIN_HISTORY_FOR_ZSCORE) & (stats["diff_std"] > 0)
+    )
+    # Large percent changes always fail; with enough history, moderate changes fail too
+    # when they are far outside the usual day-to-day movement (flat series have tiny stds)
+    jump = pct.gt(MAX_PCT_CHANGE) | (zscore.abs().gt(MAX_ZSCORE) & pct.gt(MIN_PCT_CHANGE))
+    confirmed = pd.Series(
+        {name: confirmations(history, name, current[name]) >= QUARANTINE_CONFIRMATIONS for name in current.index[jump]},
+        dtype=bool,
+    ).reindex(current.index, fill_value=False)
+
+    issues = []
+    for name in current.index[out_of_range]:
+        lo, hi = bounds.loc[name, "lo"], bounds.loc[name, "hi"]
+        issues.append(issue(name, "range", f"{current[name]:,.0f} outside [{lo:,.0f}, {hi:,.0f}]", "quarantined"))
+    for name in current.index[jump & ~out_of_range]:
+        detail = f"{current[name]:,.0f} vs previous {stats.loc[name, 'last']:,.0f} ({change[name] / stats.loc[name, 'last']:+.0%})"
+        if pd.notna(zscore[name]):
+            detail += f", z-score {zscore[name]:.1f}"
+        action = f"accepted (same value in {QUARANTINE_CONFIRMATIONS} snapshots)" if confirmed[name] else "quarantined"
+        issues.append(issue(name, "change vs previous snapshot", detail, action))
+
+    rejected = out_of_range | (jump & ~confirmed) | pd.Series(current.index.isin(list(failed)), index=current.index)
+    quarantined = {k: values[k] for k in current.index[rejected]}
+    accepted = dict(values)
+    for name in quarantined:
+        previous = stats.loc[name, "last"]
+        accepted[name] = float(previous) if pd.notna(previous) else None
+    return accepted, quarantined, issues